@@ -0,0 +1,229 @@
+"""
+Synthetic offer files and a timed runner for the newnoise CLI, shared by
+the benchmarks in this directory.
+"""
+
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+MiB = 1024 * 1024
+
+REGIONS = ["us-east-1", "eu-west-1", "ap-south-1", "cn-north-1"]
+
+
+def write_offer_file(path, products, reserved=1, free_every=50, seed=1):
+    """
+    Streams an AmazonEC2 style offer file with `products` skus to `path`,
+    laid out like the AWS files, two space indents and " : " separators.
+    Each sku has one to three OnDemand tiers and `reserved` Reserved terms
+    of two prices. One product in `free_every` is a free tier container
+    applying to five us-east-1 skus.
+    """
+    rng = random.Random(seed)
+    skus = ["S%09dX" % i for i in range(products)]
+    east = skus[::4]
+    free = ["SFREE%08d" % j for j in range(products // free_every)]
+
+    with open(path, "w") as f:
+
+        def section(name, level, entries):
+            f.write('%s"%s" : {\n' % ("  " * level, name))
+            first = True
+            for key, value in entries:
+                text = json.dumps(value, indent=2, separators=(",", " : "))
+                text = text.replace("\n", "\n" + "  " * (level + 1))
+                f.write("" if first else ",\n")
+                f.write('%s"%s" : %s' % ("  " * (level + 1), key, text))
+                first = False
+            f.write("\n%s}" % ("  " * level))
+
+        f.write('{\n  "formatVersion" : "v1.0",\n  "offerCode" : "AmazonEC2",\n')
+        section("products", 1, products_of(skus, free))
+        f.write(',\n  "terms" : {\n')
+        section("OnDemand", 2, on_demand_of(skus, free, east, rng))
+        f.write(",\n")
+        section("Reserved", 2, reserved_of(skus, reserved))
+        f.write("\n  }\n}\n")
+
+
+def products_of(skus, free):
+    for i, sku in enumerate(skus):
+        yield (
+            sku,
+            {
+                "sku": sku,
+                "productFamily": "Compute Instance",
+                "attributes": {
+                    "servicecode": "AmazonEC2",
+                    "location": "South America (São Paulo)",
+                    "regionCode": REGIONS[i % len(REGIONS)],
+                    "usagetype": "BoxUsage:t%d.large" % (i % 7),
+                    "operation": "RunInstances",
+                    "instanceType": "t%d.large" % (i % 7),
+                    "operatingSystem": "Linux",
+                },
+            },
+        )
+    for sku in free:
+        yield (
+            sku,
+            {
+                "sku": sku,
+                "productFamily": "Free",
+                "attributes": {"servicecode": "AmazonEC2", "regionCode": "us-east-1"},
+            },
+        )
+
+
+def on_demand_of(skus, free, east, rng):
+    for i, sku in enumerate(skus):
+        term = sku + ".JRTCKXETXF"
+        currency = "CNY" if REGIONS[i % len(REGIONS)].startswith("cn") else "USD"
+        tiers = 1 + i % 3
+        dimensions = {}
+        for t in range(tiers):
+            rate_code = "%s.6YS6EN2CT%d" % (term, t)
+            dimensions[rate_code] = {
+                "rateCode": rate_code,
+                "description": "$%d per hour, tier %d" % (i, t),
+                "beginRange": str(t * 100),
+                "endRange": "Inf" if t == tiers - 1 else str((t + 1) * 100),
+                "unit": "Hrs",
+                "pricePerUnit": {currency: "%.10f" % rng.random()},
+                "appliesTo": [],
+            }
+        yield sku, {term: terms_of(sku, "JRTCKXETXF", dimensions, {})}
+    for sku in free:
+        term = sku + ".JRTCKXETXF"
+        rate_code = term + ".FREE"
+        dimensions = {
+            rate_code: {
+                "rateCode": rate_code,
+                "description": "free tier",
+                "beginRange": "0",
+                "endRange": "750",
+                "unit": "Hrs",
+                "pricePerUnit": {"USD": "0"},
+                "appliesTo": rng.sample(east, min(5, len(east))),
+            }
+        }
+        yield sku, {term: terms_of(sku, "JRTCKXETXF", dimensions, {})}
+
+
+def reserved_of(skus, reserved):
+    for sku in skus:
+        terms = {}
+        for k in range(reserved):
+            code = "R%08d" % k
+            term = "%s.%s" % (sku, code)
+            dimensions = {
+                term + ".2TG2D8R56U": {
+                    "rateCode": term + ".2TG2D8R56U",
+                    "description": "Upfront Fee",
+                    "unit": "Quantity",
+                    "pricePerUnit": {"USD": "%d" % (100 + k)},
+                    "appliesTo": [],
+                },
+                term + ".6YS6EN2CTY": {
+                    "rateCode": term + ".6YS6EN2CTY",
+                    "description": "per hour",
+                    "unit": "Hrs",
+                    "pricePerUnit": {"USD": "0.%04d" % k},
+                    "appliesTo": [],
+                },
+            }
+            attributes = {
+                "LeaseContractLength": "%dyr" % (1 + k % 3),
+                "OfferingClass": "standard",
+                "PurchaseOption": "Partial Upfront",
+            }
+            terms[term] = terms_of(sku, code, dimensions, attributes)
+        yield sku, terms
+
+
+def terms_of(sku, code, dimensions, attributes):
+    return {
+        "offerTermCode": code,
+        "sku": sku,
+        "effectiveDate": "2024-01-01T00:00:00Z",
+        "priceDimensions": dimensions,
+        "termAttributes": attributes,
+    }
+
+
+def products_for_size(size, reserved=1):
+    """
+    How many products make an offer file of about `size` bytes
+    """
+    sample = 2000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "sample.json")
+        write_offer_file(path, sample, reserved)
+        return max(1, int(size / os.path.getsize(path) * sample))
+
+
+def write_datadir(datadir, products, reserved=1):
+    """
+    Lays out a data directory `aws load -d` reads, holding one AmazonEC2
+    offer file. Returns the offer file's path.
+    """
+    os.makedirs(os.path.join(datadir, "AmazonEC2"), exist_ok=True)
+    with open(os.path.join(datadir, "root.json"), "w") as f:
+        offers = {"AmazonEC2": {"currentVersionUrl": "/AmazonEC2/index.json"}}
+        json.dump({"offers": offers}, f)
+    path = os.path.join(datadir, "AmazonEC2", "resources.json")
+    write_offer_file(path, products, reserved)
+    return path
+
+
+def newnoise(args, src=None, split_size=None):
+    """
+    Runs the newnoise CLI with `args` in a process of its own and returns
+    the seconds it took. `src` puts another checkout's sources first on
+    the path, eg. to time an older revision. `split_size` overrides the
+    size from which `aws load --jobs` splits offer files.
+    """
+    code = "import sys\n"
+    if split_size is not None:
+        code += "from newnoise.aws import split\n"
+        code += f"split.SPLIT_SIZE = {split_size}\n"
+    code += "from newnoise import cli\n"
+    code += f"sys.argv = ['newnoise'] + {list(args)!r}\n"
+    code += "cli.run()\n"
+    env = dict(os.environ)
+    if src is not None:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, stdout=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start
+
+
+def dump_digest(db_name, src=None):
+    """
+    Dumps the cache `db_name` to CSV and returns the hash of the dump, to
+    check that loads being timed loaded the same
+    """
+    csv_name = f"{db_name}.csv"
+    newnoise(["aws", "dump", "-n", db_name, "-c", csv_name], src)
+    with open(csv_name, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    os.remove(csv_name)
+    return digest
+
+
+def parse_size(spec):
+    """
+    Reads a size such as 512M or 2G
+    """
+    units = {"K": 1024, "M": MiB, "G": 1024 * MiB}
+    if spec[-1:].upper() in units:
+        return int(float(spec[:-1]) * units[spec[-1:].upper()])
+    return int(spec)
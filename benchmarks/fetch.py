@@ -0,0 +1,123 @@
+"""
+Times downloads of a synthetic file from a local aiohttp server, the way
+`aws fetch` downloads offer files.
+
+    python benchmarks/fetch.py --size 2G --chunk-size 1,4,16
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import common
+
+SERVER = """
+import sys
+from aiohttp import web
+app = web.Application()
+app.router.add_static("/", sys.argv[1])
+web.run_app(app, host="127.0.0.1", port=int(sys.argv[2]), print=None)
+"""
+
+CLIENT = """
+import asyncio, sys, time
+from newnoise import download
+pairs = [(sys.argv[1], path) for path in sys.argv[3:]]
+kw = {"chunk_size": int(sys.argv[2])} if int(sys.argv[2]) else {}
+start = time.perf_counter()
+report = asyncio.run(download.fetch_filepairs(pairs, **kw))
+print(time.perf_counter() - start)
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def write_body(path, size):
+    """
+    Bytes that do not compress, so nothing on the way can shrink them
+    """
+    block = os.urandom(common.MiB)
+    with open(path, "wb") as f:
+        for _ in range(size // common.MiB):
+            f.write(block)
+        f.write(block[: size % common.MiB])
+
+
+def fetch(url, chunk_size, dst_files, src):
+    env = dict(os.environ)
+    if src is not None:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    out = subprocess.run(
+        [sys.executable, "-c", CLIENT, url, str(chunk_size), *dst_files],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return float(out.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="2G", help="File size, eg. 512M")
+    parser.add_argument("--files", type=int, default=1, help="Concurrent copies")
+    parser.add_argument(
+        "--chunk-size",
+        default="0",
+        help="Comma separated MiB per disk write, 0 for the default",
+    )
+    parser.add_argument("--dir", help="Work directory (default a temporary one)")
+    parser.add_argument("--src", help="Sources of the newnoise to time")
+    args = parser.parse_args()
+
+    size = common.parse_size(args.size)
+    with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+        served = os.path.join(work_dir, "served")
+        os.makedirs(served)
+        write_body(os.path.join(served, "big.bin"), size)
+        port = free_port()
+        server = subprocess.Popen([sys.executable, "-c", SERVER, served, str(port)])
+        try:
+            wait_for(port)
+            url = f"http://127.0.0.1:{port}/big.bin"
+            print("%-12s %9s %9s" % ("chunk MiB", "seconds", "MiB/s"))
+            for chunk in args.chunk_size.split(","):
+                dst_files = [
+                    os.path.join(work_dir, "fetched", f"{i}.bin")
+                    for i in range(args.files)
+                ]
+                chunk_size = int(float(chunk) * common.MiB)
+                seconds = fetch(url, chunk_size, dst_files, args.src)
+                for dst_file in dst_files:
+                    if os.path.getsize(dst_file) != size:
+                        raise RuntimeError(f"{dst_file} is incomplete")
+                    os.remove(dst_file)
+                total = size * args.files / common.MiB
+                label = chunk if chunk_size else "default"
+                print("%-12s %9.1f %9.1f" % (label, seconds, total / seconds))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
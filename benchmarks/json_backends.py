@@ -0,0 +1,45 @@
+"""
+Times `aws load --fast` of a synthetic AmazonEC2 offer file with each
+--json-backend, and checks they load the same rows.
+
+    python benchmarks/json_backends.py --size 256M
+"""
+
+import argparse
+import os
+import tempfile
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="256M", help="Offer file size, eg. 1G")
+    parser.add_argument(
+        "--backends",
+        default="json_stream,ijson",
+        help="Comma separated backends, each has to be installed",
+    )
+    parser.add_argument("--dir", help="Work directory (default a temporary one)")
+    parser.add_argument("--src", help="Sources of the newnoise to time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+        datadir = os.path.join(work_dir, "noises")
+        products = common.products_for_size(common.parse_size(args.size))
+        path = common.write_datadir(datadir, products)
+        print(f"offer file: {os.path.getsize(path) / common.MiB:.0f} MiB")
+        digests = set()
+        print("%-12s %9s" % ("backend", "seconds"))
+        for backend in args.backends.split(","):
+            db_name = os.path.join(work_dir, f"{backend}.db")
+            argv = ["aws", "load", "--fast", "-d", datadir, "-n", db_name]
+            argv += ["--json-backend", backend]
+            seconds = common.newnoise(argv, args.src)
+            print("%-12s %9.1f" % (backend, seconds))
+            digests.add(common.dump_digest(db_name, args.src))
+        print(f"dumps identical: {len(digests) == 1}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Times `aws load` of a synthetic AmazonEC2 offer file heavy in prices,
+once per checkout given with --src, and checks they load the same rows.
+
+    python benchmarks/prices.py --src /tmp/before/src --src src
+"""
+
+import argparse
+import os
+import tempfile
+
+import common
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=15000, help="Products")
+    parser.add_argument(
+        "--reserved", type=int, default=24, help="Reserved terms per product"
+    )
+    parser.add_argument("--dir", help="Work directory (default a temporary one)")
+    parser.add_argument(
+        "--src",
+        action="append",
+        help="Sources of a newnoise to time, repeated to compare (default the one "
+        "importable)",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+        datadir = os.path.join(work_dir, "noises")
+        path = common.write_datadir(datadir, args.products, args.reserved)
+        print(f"offer file: {os.path.getsize(path) / common.MiB:.0f} MiB")
+        digests = set()
+        print("%-40s %9s" % ("sources", "seconds"))
+        for i, src in enumerate(args.src or [None]):
+            db_name = os.path.join(work_dir, f"{i}.db")
+            seconds = common.newnoise(
+                ["aws", "load", "-d", datadir, "-n", db_name], src
+            )
+            print("%-40s %9.1f" % (src or "importable", seconds))
+            digests.add(common.dump_digest(db_name, src))
+        print(f"dumps identical: {len(digests) == 1}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Times `aws load --fast` of one big synthetic AmazonEC2 offer file with
+--jobs 1, 2 and 4, each with the file split into chunks and loaded whole.
+Speedup is against --jobs 1 loaded whole, a sequential load. Split
+chunks are parsed with the stdlib decoder rather than the streaming one,
+which is a gain of its own even on one core, so scaling compares split
+loads with the split load of the fewest jobs, which is what more cores
+should improve.
+
+    python benchmarks/split_load.py --size 2G
+"""
+
+import argparse
+import os
+import tempfile
+
+import common
+
+# Never split, every offer file loads whole
+WHOLE = 2**63
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", default="2G", help="Offer file size, eg. 512M")
+    parser.add_argument("--jobs", default="1,2,4", help="Comma separated --jobs")
+    parser.add_argument("--dir", help="Work directory (default a temporary one)")
+    parser.add_argument("--src", help="Sources of the newnoise to time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as work_dir:
+        datadir = os.path.join(work_dir, "noises")
+        products = common.products_for_size(common.parse_size(args.size))
+        path = common.write_datadir(datadir, products)
+        size = os.path.getsize(path)
+        print(f"offer file: {size / common.MiB:.0f} MiB, {products} products")
+
+        baseline = first_split = None
+        digests = set()
+        print(
+            "%-6s %-6s %9s %8s %8s" % ("jobs", "mode", "seconds", "speedup", "scaling")
+        )
+        for jobs in [int(j) for j in args.jobs.split(",")]:
+            for mode, split_size in [("whole", WHOLE), ("split", 0)]:
+                if jobs == 1 and mode == "split":
+                    # one job never splits
+                    continue
+                db_name = os.path.join(work_dir, f"{mode}-{jobs}.db")
+                argv = ["aws", "load", "--fast", "-d", datadir, "-n", db_name]
+                argv += ["--jobs", str(jobs)]
+                seconds = common.newnoise(argv, args.src, split_size)
+                baseline = baseline or seconds
+                scaling = ""
+                if mode == "split":
+                    first_split = first_split or seconds
+                    scaling = "%.2fx" % (first_split / seconds)
+                print(
+                    "%-6d %-6s %9.1f %7.2fx %8s"
+                    % (jobs, mode, seconds, baseline / seconds, scaling)
+                )
+                digests.add(common.dump_digest(db_name, args.src))
+                os.remove(db_name)
+        print(f"cpus: {os.cpu_count()}, dumps identical: {len(digests) == 1}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
-from . import aws, cli, download, sheet
+from . import aws, cli, compress, download, jsonio, sheet, snapshot
 
-__all__ = [aws, cli, download, sheet]
+__all__ = [aws, cli, compress, download, jsonio, sheet, snapshot]
@@ -1,3 +1,3 @@
-from . import commands, data, db, env, transforms
+from . import commands, data, db, env, metrics, transforms
 
-__all__ = [commands, data, db, env, transforms]
+__all__ = [commands, data, db, env, metrics, transforms]
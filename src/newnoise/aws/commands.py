@@ -1,65 +1,581 @@
 import asyncio
-import csv
+import concurrent.futures
+import functools
 import os
+import sys
+import tempfile
+import time
 
-from .. import download
-from . import data, db, env
-from . import transforms as t
+from .. import compress, download, jsonio, sheet, snapshot
+from . import data, db, env, metrics, split
 
 
-def fetch(args):
-    noises_root = args.datadir
+def service_filter(args):
+    sheet_services = sheet.commands.servicecodes() if args.sheet_services else None
+    return data.mk_service_filter(args.services, sheet_services)
+
+
+def load_filter(args):
+    terms = data.parse_list(args.terms)
+    unknown = sorted(set(terms or ()) - set(data.TERM_KINDS))
+    if unknown:
+        sys.stderr.write("ERROR: unknown kinds of terms: %s\n" % ", ".join(unknown))
+        sys.exit(1)
+    return data.LoadFilter(
+        terms=terms,
+        currencies=data.parse_list(args.currencies),
+        regions=data.parse_regions(args.regions),
+        families=data.parse_list(args.product_families),
+    )
+
+
+def hot_attributes(args):
+    """
+    The hot attributes asked for, an empty list if `--hot-attributes` was
+    given empty, None if it was not given at all
+    """
+    if args.hot_attributes is None:
+        return None
+    names = data.parse_list(args.hot_attributes) or []
+    try:
+        return db.check_hot_attributes(names)
+    except ValueError as e:
+        sys.stderr.write("ERROR: %s\n" % e)
+        sys.exit(1)
+
+
+def mk_db_kwargs(args):
+    """
+    How a new database is laid out, which stays with it
+    """
+    return {
+        "hot_attributes": hot_attributes(args),
+        "compact_attributes": args.compact_attributes,
+    }
 
+
+def report_metrics(args, collected):
+    """
+    Writes the metrics of each service loaded to the --metrics file, and
+    prints them, most costly first
+    """
+    if not args.metrics:
+        return
+    services = metrics.by_service(collected)
+    metrics.write_jsonl(args.metrics, services)
+    metrics.print_summary(services)
+
+
+def fetch_kwargs(args):
+    return {
+        "max_concurrent": args.max_concurrent,
+        "chunk_size": args.chunk_size * download.MiB,
+        "retries": args.retries,
+        "max_bandwidth": args.max_bandwidth and args.max_bandwidth * download.MiB,
+    }
+
+
+def fetch_indexes(noises_root, want, regions, fetch_kw):
+    """
+    Fetches the pricing root and, for `regions`, the region indexes that
+    service files are found through.
+    """
     # prepare work dir
     os.makedirs(noises_root, exist_ok=True)
 
     # fetch pricing root for aws
-    files = [(env.PRICE_ROOT, data.nr_path(noises_root, "root.json"))]
-    asyncio.run(download.fetch_filepairs(files))
+    root_path = data.nr_path(noises_root, "root.json")
+    files = [(env.PRICE_ROOT, root_path)]
+    report = asyncio.run(download.fetch_filepairs(files, **fetch_kw))
+    if not os.path.exists(root_path):
+        sys.stderr.write("ERROR: could not fetch pricing root %s\n" % (env.PRICE_ROOT))
+        sys.exit(1)
+
+    # region indexes list the per-region files of each service
+    if regions:
+        files = data.region_index_pairs(noises_root, root_path, want)
+        report += asyncio.run(download.fetch_filepairs(files, **fetch_kw))
+    return root_path, report
+
+
+def fetch(args):
+    noises_root = args.datadir
+    want = service_filter(args)
+    regions = data.parse_regions(args.regions)
+    fetch_kw = fetch_kwargs(args)
+    fetch_kw["probe"] = args.probe
+    # unchanged files are skipped using what the last fetch recorded
+    fetch_kw["manifest_path"] = data.nr_path(noises_root, "manifest.json")
+
+    root_path, report = fetch_indexes(noises_root, want, regions, fetch_kw)
 
     # load pricing for all aws services
-    root_path = data.nr_path(noises_root, "root.json")
-    files = data.service_pairs(noises_root, root_path)
-    asyncio.run(download.fetch_filepairs(files))
+    files = data.service_pairs(noises_root, root_path, want, regions, args.compress)
+    services_report = asyncio.run(download.fetch_filepairs(files, **fetch_kw))
+    for t in services_report:
+        if t["ok"]:
+            compress.remove_variants(t["path"])
+    report += services_report
 
-    return files
+    if not all(t["ok"] for t in report):
+        sys.exit(1)
 
+    # only complete fetches are kept as history
+    if args.snapshot:
+        snap = snapshot.take(noises_root, [t["path"] for t in report])
+        print("snapshot %s: %d files" % (snap["date"], len(snap["files"])))
+    return report
 
-def load(args):
+
+def sync(args):
     noises_root = args.datadir
+    want = service_filter(args)
+    regions = data.parse_regions(args.regions)
+    fetch_kw = fetch_kwargs(args)
+
+    root_path, report = fetch_indexes(noises_root, want, regions, fetch_kw)
+    db.mk_db(args.name, **mk_db_kwargs(args)).close()
+
+    # offer files go straight from the network into the database
+    files = data.service_pairs(noises_root, root_path, want, regions, args.compress)
+    collected = []
+    consume = functools.partial(
+        data.load_pipe,
+        args.name,
+        backend=args.json_backend,
+        load_filter=load_filter(args),
+        collect=collected,
+    )
+    services_report = asyncio.run(
+        download.stream_filepairs(files, consume, tee=args.tee, **fetch_kw)
+    )
+    if args.tee:
+        for t in services_report:
+            if t["ok"]:
+                compress.remove_variants(t["path"])
+    report += services_report
+    report_metrics(args, collected)
+
+    if not all(t["ok"] for t in report):
+        sys.exit(1)
+    return report
+
+
+def load(args):
+    if args.snapshot:
+        try:
+            checkout = snapshot.checkout(args.datadir, args.snapshot)
+        except ValueError as e:
+            have = ", ".join(snapshot.dates(args.datadir)) or "none"
+            sys.stderr.write("ERROR: %s, snapshots: %s\n" % (e, have))
+            sys.exit(1)
+        with checkout as noises_root:
+            load_from(args, noises_root)
+    else:
+        load_from(args, args.datadir)
+
+
+def load_from(args, noises_root):
     db_name = args.name
+    want = service_filter(args)
+    regions = data.parse_regions(args.regions)
 
     root_path = data.nr_path(noises_root, "root.json")
-    pairs = data.service_pairs(noises_root, root_path)
-    dbconn = db.mk_db(db_name)
-    for _, resources_file in pairs:
-        data.load_service(dbconn, resources_file)
+    pairs = data.service_pairs(noises_root, root_path, want, regions)
+    keep = load_filter(args)
+    if not args.incremental and db.connect(db_name):
+        sys.stderr.write("ERROR: db file already exists %s" % (db_name))
+        sys.exit(-1)
+
+    # a fast load builds in a scratch file that is renamed into place
+    build_name = f"{db_name}.tmp" if args.fast else db_name
+    if args.fast and os.path.exists(build_name):
+        os.remove(build_name)
+
+    resources_files = []
+    for _, resources_path in pairs:
+        resources_file = compress.existing(resources_path)
+        if resources_file is None:
+            sys.stderr.write("WARNING: not fetched, skipping %s\n" % (resources_path))
+            continue
+        resources_files.append(resources_file)
+
+    start = time.monotonic()
+    collected = []
+    if args.incremental:
+        dbconn = db.connect(db_name)
+        if dbconn is None:
+            dbconn = db.mk_db(db_name, **mk_db_kwargs(args))
+        db.check_version(dbconn, db_name)
+        failed = load_incremental(
+            dbconn, args, keep, noises_root, resources_files, collected
+        )
+    else:
+        dbconn = db.mk_db(build_name, fast=args.fast, **mk_db_kwargs(args))
+        failed = load_files(dbconn, db_name, resources_files, args, keep, collected)
+        # services that failed are left unrecorded, so --incremental retries them
+        failed_services = {data.service_of(f) for f, _ in failed}
+        loaded_files = [
+            f for f in resources_files if data.service_of(f) not in failed_services
+        ]
+        digests = data.source_digests(noises_root, loaded_files, keep)
+        db.record_sources(dbconn, digests)
+    if args.fast:
+        db.finish_db(dbconn)
+
+    products, prices = db.count_rows(dbconn)
+    dbconn.close()
+    if args.fast:
+        os.replace(build_name, db_name)
+    elapsed = time.monotonic() - start
+    rate = (products + prices) / elapsed if elapsed > 0 else 0
+    report_metrics(args, collected)
+    print(
+        "loaded %d products and %d prices in %.1fs (%.0f rows/s)"
+        % (products, prices, elapsed, rate)
+    )
+    if failed:
+        for resources_file, error in failed:
+            sys.stderr.write("ERROR: failed to load %s: %s\n" % (resources_file, error))
+        sys.exit(1)
+
+
+def load_files(dbconn, db_name, resources_files, args, keep, collect):
+    """
+    Loads what `keep` wants of `resources_files` into `dbconn`, returning
+    the (file, error) of every file that failed to load. The others are
+    loaded regardless. The `metrics` of each file loaded are appended to
+    `collect`.
+
+    Loading one file after another, a file that fails part way may leave
+    some of its rows behind. Its service is not recorded as a source, so
+    `--incremental` loads it again.
+    """
+    if args.jobs > 1:
+        return load_shards(
+            dbconn,
+            db_name,
+            resources_files,
+            args.jobs,
+            args.json_backend,
+            keep,
+            collect,
+        )
+    failed = []
+    for resources_file in resources_files:
+        try:
+            stats = data.load_service(dbconn, resources_file, args.json_backend, keep)
+        except Exception as e:
+            failed.append((resources_file, f"{type(e).__name__}: {e}"))
+            continue
+        collect.append(stats)
+    return failed
+
+
+def load_incremental(dbconn, args, keep, noises_root, resources_files, collect):
+    """
+    Reloads the services whose offer files changed since they were last
+    loaded, and keeps the rest. Each changed service is loaded into a
+    staging database, then swapped in by a transaction of its own, so an
+    interrupted load carries on from the services it had not swapped in
+    yet. Returns the (file, error) of every file that failed to load.
+    """
+    digests = data.source_digests(noises_root, resources_files, keep)
+    loaded = db.sources(dbconn)
+    changed = [s for s in digests if loaded.get(s) != digests[s]]
+    print("%d of %d services changed" % (len(changed), len(digests)))
+
+    failed = []
+    parent = os.path.dirname(os.path.abspath(args.name))
+    with tempfile.TemporaryDirectory(prefix=".staging-", dir=parent) as staging_dir:
+        for service in changed:
+            files = [f for f in resources_files if data.service_of(f) == service]
+            staging_name = os.path.join(staging_dir, f"{service}.db")
+            staging = db.mk_shard_db(staging_name)
+            try:
+                service_failed = load_files(
+                    staging, staging_name, files, args, keep, collect
+                )
+            finally:
+                staging.close()
+            if service_failed:
+                failed.extend(service_failed)
+                continue
+            stats = metrics.mk_stats(service)
+            start = time.perf_counter()
+            db.replace_service(dbconn, staging_name, service, digests[service])
+            stats["merge_s"] = stats["wall_s"] = time.perf_counter() - start
+            collect.append(stats)
+            os.remove(staging_name)
+    return failed
+
+
+def load_shards(dbconn, db_name, resources_files, jobs, backend, keep, collect):
+    """
+    Loads each offer file into a shard database of its own in a pool of
+    `jobs` processes, then merges the shards into `dbconn` in the order of
+    `resources_files`, so rows end up as a sequential load would leave
+    them. Returns the (file, error) of every file that failed to load,
+    the others are merged regardless. The `metrics` of each file merged,
+    from its workers and the merge, are appended to `collect`.
+
+    Big uncompressed files, eg. AmazonEC2, are split at entry boundaries
+    into chunks that load in parallel too, with one shard per chunk.
+    """
+    failed = []
+    shard_parent = os.path.dirname(os.path.abspath(db_name))
+    with tempfile.TemporaryDirectory(prefix=".shards-", dir=shard_parent) as shard_dir:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            shards = []
+            for i, resources_file in enumerate(resources_files):
+                parts = []
+                if split.splittable(resources_file):
+                    chunks = split.offer_chunks(resources_file)
+                    service = data.service_of(resources_file)
+                    print("#####", service, "in %d chunks" % len(chunks))
+                    for j, chunk in enumerate(chunks):
+                        if chunk[0] != "products" and not keep.wants_terms(chunk[0]):
+                            continue
+                        shard_name = os.path.join(shard_dir, f"{i}.{j}.db")
+                        future = pool.submit(
+                            data.load_chunk, shard_name, resources_file, *chunk, keep
+                        )
+                        parts.append((chunk[0], shard_name, future))
+                else:
+                    shard_name = os.path.join(shard_dir, f"{i}.db")
+                    future = pool.submit(
+                        data.load_shard, shard_name, resources_file, backend, keep
+                    )
+                    parts.append((None, shard_name, future))
+                shards.append((resources_file, parts))
+
+            # merge in order as shards complete, while later ones still load
+            for resources_file, parts in shards:
+                try:
+                    results = [future.result() for _, _, future in parts]
+                except Exception as e:
+                    failed.append((resources_file, f"{type(e).__name__}: {e}"))
+                    continue
+                stats = merge_parts(dbconn, resources_file, parts, results, keep)
+                collect.append(stats)
+    return failed
+
+
+def merge_parts(dbconn, resources_file, parts, results, keep):
+    """
+    Merges the shards of one offer file. Free tiers gathered from its
+    OnDemand chunks are merged right after the last of them, where a
+    sequential load would merge them. Chunks of terms cannot tell which
+    products `keep` left out, so their prices are dropped at the end.
+
+    Returns the `metrics` of loading the file, from every shard plus the
+    merge.
+    """
+    start = time.perf_counter()
+    stats = metrics.mk_stats(data.service_of(resources_file))
+    containers = []
+    for (section, _, _), result in zip(parts, results):
+        if section is None:
+            # a whole file merged its own free tiers
+            result = [], result
+        containers.append(result[0])
+        metrics.add(stats, result[1])
+    stats["files"] = 1
+    applies_tos = []
+    for k, ((section, shard_name, _), result) in enumerate(zip(parts, containers)):
+        db.merge_shard(dbconn, shard_name)
+        os.remove(shard_name)
+        if section == "OnDemand":
+            applies_tos.extend(result)
+            if k + 1 == len(parts) or parts[k + 1][0] != "OnDemand":
+                db.update_applies(dbconn, applies_tos, "on_demand")
+                applies_tos = []
+    if parts and parts[0][0] is not None and keep.filters_products():
+        db.delete_unmatched_prices(dbconn)
+    stats["merge_s"] += time.perf_counter() - start
+    stats["wall_s"] += time.perf_counter() - start
+    return stats
+
+
+def snapshots(args):
+    noises_root = args.datadir
+    if args.keep is not None:
+        dropped, freed = snapshot.prune(noises_root, args.keep)
+        for date in dropped:
+            print("removed", date)
+        print("freed %.1f MiB" % (freed / download.MiB))
+
+    for date in snapshot.dates(noises_root):
+        files = snapshot.load(noises_root, date)["files"]
+        size = sum(e["size"] for e in files.values())
+        print("%s  %4d files  %10.1f MiB" % (date, len(files), size / download.MiB))
+    stored, logical = snapshot.usage(noises_root)
+    print(
+        "stored %.1f MiB for %.1f MiB of snapshots"
+        % (stored / download.MiB, logical / download.MiB)
+    )
 
 
 def dump(args):
     csvfile = args.csvfile
     db_name = args.name
+    want = service_filter(args)
+    if args.jobs > 1 and args.shard_by is None:
+        sys.stderr.write("ERROR: --jobs needs --shard-by\n")
+        sys.exit(1)
 
     dbconn = db.connect(db_name)
-    with open(csvfile, mode="w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file, quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        headers = [
-            "productHash",
-            "sku",
-            "vendorName",
-            "region",
-            "service",
-            "productFamily",
-            "attributes",
-            "prices",
-        ]
-        writer.writerow(headers)
-        for row in db.dump_products(dbconn):
-            # reformat price column from format in db cache to csv
-            (ph, sku, vn, r, s, pf, a, p) = row
-            csv_prices = t.price_csv_format(p)
-            row = (ph, sku, vn, r, s, pf, a, csv_prices)
-            writer.writerow(row)
+    db.check_version(dbconn, db_name)
+    services = None
+    if args.services or args.sheet_services:
+        services = [s for s in db.services(dbconn) if want(s)]
+    attributes = {}
+    for spec in args.attributes or []:
+        name, sep, value = spec.partition("=")
+        if not sep:
+            sys.stderr.write("ERROR: expected NAME=VALUE, got %s\n" % spec)
+            sys.exit(1)
+        attributes[name] = value
+    if args.shard_by is None:
+        dbconn.close()
+        data.dump_csv(db_name, csvfile, services, attributes)
+        return
+    sizes = db.shard_sizes(dbconn, args.shard_by, services)
+    dbconn.close()
+    dump_parts(args, sizes, services, attributes)
+
+
+def dump_parts(args, sizes, services, attributes):
+    """
+    Writes a part of the dump for each service or region in `sizes`, in a
+    pool of --jobs processes reading the cache at once, biggest part first.
+    Then writes the manifest that lists the parts.
+    """
+    parts = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = []
+        for key in sorted(sizes, key=lambda k: sizes[k], reverse=True):
+            part_file = data.part_path(args.csvfile, key)
+            if args.shard_by == "service":
+                shard = {"services": [key]}
+            else:
+                shard = {"services": services, "regions": [key]}
+            future = pool.submit(
+                data.dump_csv, args.name, part_file, attributes=attributes, **shard
+            )
+            futures.append((key, part_file, future))
+        for key, part_file, future in futures:
+            part = {"key": key}
+            part.update(future.result())
+            parts[os.path.basename(part_file)] = part
+            print("%s :: %d rows" % (part_file, part["rows"]))
+    manifest = data.save_dump_manifest(args.csvfile, args.shard_by, parts)
+    rows = sum(part["rows"] for part in parts.values())
+    print("%s :: %d parts, %d rows" % (manifest, len(parts), rows))
+
+
+def add_service_arguments(parser):
+    parser.add_argument(
+        "--sheet-services",
+        action="store_true",
+        help="Only use the services consumed by the sheet handlers",
+    )
+    parser.add_argument(
+        "-s",
+        "--services",
+        help="Comma separated servicecodes to use, prefix a code with - to skip it",
+    )
+
+
+def add_region_arguments(parser):
+    parser.add_argument(
+        "-r",
+        "--regions",
+        help="Comma separated region codes to use instead of every region",
+    )
+
+
+def add_load_filter_arguments(parser):
+    parser.add_argument(
+        "--terms",
+        help="Comma separated kinds of terms to load, eg. OnDemand, instead of all",
+    )
+    parser.add_argument(
+        "--currencies",
+        help="Comma separated currencies, eg. USD, to load prices in",
+    )
+    parser.add_argument(
+        "--product-families",
+        help="Comma separated product families to load instead of every family",
+    )
+
+
+def add_db_layout_arguments(parser):
+    parser.add_argument(
+        "--hot-attributes",
+        help="Comma separated attributes a new database gives indexed columns",
+    )
+    parser.add_argument(
+        "--compact-attributes",
+        action="store_true",
+        help="Store attributes in a new database as compact blobs",
+    )
+
+
+def add_metrics_argument(parser):
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write per service load metrics to FILE as JSON lines, and print them",
+    )
+
+
+def add_json_backend_argument(parser):
+    parser.add_argument(
+        "--json-backend",
+        choices=jsonio.available(),
+        default=jsonio.DEFAULT_BACKEND,
+        help="Streaming JSON parser for offer files",
+    )
+
+
+def add_fetch_arguments(parser):
+    parser.add_argument(
+        "-d",
+        "--datadir",
+        default=env.NOISES_ROOT,
+        help="Directory path to store price data",
+    )
+    parser.add_argument(
+        "-j",
+        "--max-concurrent",
+        type=int,
+        default=8,
+        help="Most downloads to run at once, concurrency adapts up to this",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=5,
+        help="Times a failed download is retried before it is reported",
+    )
+    parser.add_argument(
+        "--max-bandwidth",
+        type=float,
+        help="Cap on the combined download rate in MiB/s",
+    )
+    parser.add_argument(
+        "-z",
+        "--compress",
+        choices=compress.available(),
+        help="Compress offer files as they are written to disk",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=download.CHUNK_SIZE // download.MiB,
+        help="MiB collected in memory per write to disk",
+    )
 
 
 def init_parsers(parsers):
@@ -73,12 +589,44 @@ def init_parsers(parsers):
     # fetch
     fetch_parser = aws_subparsers.add_parser("fetch", help="Fetch price data")
     fetch_parser.set_defaults(func=fetch, parser=fetch_parser)
+    add_fetch_arguments(fetch_parser)
     fetch_parser.add_argument(
-        "-d",
-        "--datadir",
-        default=env.NOISES_ROOT,
-        help="Directory path to store price data",
+        "--no-size-probe",
+        dest="probe",
+        action="store_false",
+        help="Do not ask for file sizes missing from the manifest before fetching",
+    )
+    fetch_parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Record the fetched files as today's snapshot",
+    )
+    add_service_arguments(fetch_parser)
+    add_region_arguments(fetch_parser)
+
+    # sync
+    sync_parser = aws_subparsers.add_parser(
+        "sync", help="Load price data into a new database as it downloads"
+    )
+    sync_parser.set_defaults(func=sync, parser=sync_parser)
+    add_fetch_arguments(sync_parser)
+    sync_parser.add_argument(
+        "-n",
+        "--name",
+        default=env.NOISES_DB,
+        help="Name for the SQLite database file",
+    )
+    sync_parser.add_argument(
+        "--tee",
+        action="store_true",
+        help="Also write the offer files to the data directory",
     )
+    add_json_backend_argument(sync_parser)
+    add_metrics_argument(sync_parser)
+    add_load_filter_arguments(sync_parser)
+    add_db_layout_arguments(sync_parser)
+    add_service_arguments(sync_parser)
+    add_region_arguments(sync_parser)
 
     # load
     load_parser = aws_subparsers.add_parser("load", help="Load data into database")
@@ -95,6 +643,52 @@ def init_parsers(parsers):
         default=env.NOISES_DB,
         help="Name for the SQLite database file",
     )
+    load_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Processes loading offer files, big files are split between them",
+    )
+    build_mode = load_parser.add_mutually_exclusive_group()
+    build_mode.add_argument(
+        "--fast",
+        action="store_true",
+        help="Build the database with bulk load settings, then move it into place",
+    )
+    build_mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update the database, reloading only services whose files changed",
+    )
+    load_parser.add_argument(
+        "--snapshot",
+        metavar="DATE",
+        help="Load the files fetched on DATE (YYYY-MM-DD) instead of the latest",
+    )
+    add_json_backend_argument(load_parser)
+    add_metrics_argument(load_parser)
+    add_load_filter_arguments(load_parser)
+    add_db_layout_arguments(load_parser)
+    add_service_arguments(load_parser)
+    add_region_arguments(load_parser)
+
+    # snapshots
+    snapshots_parser = aws_subparsers.add_parser(
+        "snapshots", help="List or prune fetch snapshots"
+    )
+    snapshots_parser.set_defaults(func=snapshots, parser=snapshots_parser)
+    snapshots_parser.add_argument(
+        "-d",
+        "--datadir",
+        default=env.NOISES_ROOT,
+        help="Directory path to store price data",
+    )
+    snapshots_parser.add_argument(
+        "--keep",
+        type=int,
+        help="Delete all but this many of the newest snapshots",
+    )
 
     # dump
     dump_parser = aws_subparsers.add_parser("dump", help="Dump data to CSV")
@@ -111,3 +705,24 @@ def init_parsers(parsers):
         default=env.NOISES_CSV,
         help="Name of the CSV file to create",
     )
+    dump_parser.add_argument(
+        "-a",
+        "--attribute",
+        dest="attributes",
+        action="append",
+        metavar="NAME=VALUE",
+        help="Only dump products with this attribute value, can be repeated",
+    )
+    dump_parser.add_argument(
+        "--shard-by",
+        choices=db.SHARD_COLUMNS,
+        help="Write a CSV per service or region next to --csvfile, and a manifest",
+    )
+    dump_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Processes writing the parts of a --shard-by dump",
+    )
+    add_service_arguments(dump_parser)
@@ -1,9 +1,13 @@
+import csv
+import hashlib
 import json
 import os
+import re
+import tempfile
+import time
 
-import json_stream
-
-from . import db, env
+from .. import compress, download, jsonio, snapshot
+from . import db, env, metrics, split
 
 
 def nr_path(noises_root, path, parent=None):
@@ -12,61 +16,436 @@ def nr_path(noises_root, path, parent=None):
     return os.path.join(noises_root, path)
 
 
-def service_pairs(nr, root_path):
+def parse_list(spec):
+    """
+    Splits a comma separated list, None means no list was given
+    """
+    if not spec:
+        return None
+    return [item.strip() for item in spec.split(",") if item.strip()]
+
+
+def parse_regions(spec):
+    """
+    Splits a comma separated list of region codes, None means all regions
+    """
+    return parse_list(spec)
+
+
+def parse_services(spec):
+    """
+    Splits a comma separated list of servicecodes into the codes to include
+    and the codes, prefixed with a "-", to exclude.
+    """
+    include, exclude = set(), set()
+    for code in (spec or "").split(","):
+        code = code.strip()
+        if code.startswith("-"):
+            exclude.add(code[1:])
+        elif code:
+            include.add(code)
+    return include, exclude
+
+
+def mk_service_filter(services=None, sheet_services=None):
+    """
+    Returns a predicate for choosing which services to fetch, load and dump.
+
+    `sheet_services` is the set of servicecodes the sheet handlers consume,
+    or None for every service. Codes included by `services` are added to that
+    set, or replace "every service" if no sheet set is given, and codes it
+    excludes are always dropped.
+    """
+    include, exclude = parse_services(services)
+    allowed = sheet_services
+    if include:
+        allowed = (allowed or set()) | include
+
+    def want(service):
+        return (allowed is None or service in allowed) and service not in exclude
+
+    return want
+
+
+def offers(root_path, want=None):
     # load it
     root_data = json.load(open(root_path))
 
-    # fetch pricing root for each aws service
     for service, urls in root_data["offers"].items():
+        if want and not want(service):
+            continue
+        yield service, urls
+
+
+def resources_path(nr, service, region=None):
+    filename = f"resources.{region}.json" if region else "resources.json"
+    return nr_path(nr, filename, parent=service)
+
+
+def region_index_pairs(nr, root_path, want=None):
+    """
+    Yields the region index of every service that publishes one. Each index
+    lists the per-region offer files `service_pairs` picks from.
+    """
+    for service, urls in offers(root_path, want):
+        if "currentRegionIndexUrl" in urls:
+            index_path = urls["currentRegionIndexUrl"]
+            index_url = f"{env.PRICE_API}{index_path}"
+            yield (index_url, nr_path(nr, "region_index.json", parent=service))
+
+
+def service_pairs(nr, root_path, want=None, regions=None, compression=None):
+    # fetch pricing root for each aws service
+    for service, urls in offers(root_path, want):
         # dir for service data
         svc_dir = nr_path(nr, service)
         os.makedirs(svc_dir, exist_ok=True)
 
+        # per-region prices, when a region index was fetched for the service
+        index_file = nr_path(nr, "region_index.json", parent=service)
+        if regions and "currentRegionIndexUrl" in urls and os.path.exists(index_file):
+            region_data = json.load(open(index_file))["regions"]
+            for region in regions:
+                if region in region_data:
+                    dst_file = resources_path(nr, service, region)
+                    dst_file = compress.path_for(dst_file, compression)
+                    prices_path = region_data[region]["currentVersionUrl"]
+                    prices_url = f"{env.PRICE_API}{prices_path}"
+                    yield (prices_url, dst_file)
+            continue
+
         # write prices
-        # TODO: consider date based filenames for resources
-        dst_file = nr_path(nr, "resources.json", parent=service)
+        dst_file = compress.path_for(resources_path(nr, service), compression)
         prices_path = urls["currentVersionUrl"]
         prices_url = f"{env.PRICE_API}{prices_path}"
         yield (prices_url, dst_file)
 
 
-def load_products(dbconn, service, products):
-    handler = db.mk_insert_product(dbconn, service)
-    db.load_data(dbconn, products, handler)
+def service_of(filename):
+    return os.path.basename(os.path.dirname(filename))
 
 
-def load_prices_on_demand(dbconn, prices):
-    handler, applies_tos = db.mk_insert_price(dbconn, "on_demand")
-    db.load_data(dbconn, prices, handler)
-    db.update_applies(dbconn, applies_tos, "on_demand")
+def source_digests(noises_root, filenames, load_filter=None):
+    """
+    Maps each service to a digest of its offer files, names included, so
+    loading a different set of regions counts as a change too. So does
+    loading with a different `load_filter`.
+    """
+    hashes = {}
+    for filename in filenames:
+        service = service_of(filename)
+        if service not in hashes:
+            hashes[service] = hashlib.sha256()
+            if load_filter is not None:
+                hashes[service].update(f"{load_filter.key()}\n".encode())
+        h = hashes[service]
+        rel = os.path.relpath(filename, noises_root)
+        h.update(f"{rel} {snapshot.file_digest(filename)}\n".encode())
+    return {service: h.hexdigest() for service, h in hashes.items()}
 
 
-def load_prices_reserved(dbconn, prices):
-    handler, _ = db.mk_insert_price(dbconn, "reserved")
-    db.load_data(dbconn, prices, handler)
+# Kinds of terms the loader reads
+TERM_KINDS = ["OnDemand", "Reserved"]
 
 
-def load_all(db, filename):
-    data = json_stream.load(open(filename))
+class LoadFilter:
+    """
+    The parts of offer files `aws load` keeps, None for any of them keeps
+    everything.
+
+    Products are checked once decoded, their family and region being
+    inside them, and only the terms of products kept are loaded. Terms of
+    a kind left out, and the terms of products left out, are skipped before
+    they are decoded.
+    """
+
+    def __init__(self, terms=None, currencies=None, regions=None, families=None):
+        self.terms = terms
+        self.currencies = currencies
+        self.regions = regions
+        self.families = families
+
+    def filters_products(self):
+        return self.regions is not None or self.families is not None
+
+    def wants_terms(self, kind):
+        return self.terms is None or kind in self.terms
+
+    def wants_product(self, product):
+        if self.families is not None:
+            if product.get("productFamily", "") not in self.families:
+                return False
+        # products without a region, eg. global ones, are in every region
+        region = product["attributes"].get("regionCode", "")
+        if self.regions is not None and region and region not in self.regions:
+            return False
+        return True
+
+    def key(self):
+        """
+        Describes the filter for `source_digests`, so loading with other
+        filters counts as a change.
+        """
+        fields = [self.terms, self.currencies, self.regions, self.families]
+        return json.dumps([sorted(f) if f is not None else None for f in fields])
+
+
+def load_products(dbconn, service, products, load_filter=None, stats=None):
+    """
+    Returns the skus loaded, or None when every product was.
+    """
+    if stats is None:
+        stats = metrics.mk_stats(service)
+    want = None
+    if load_filter is not None and load_filter.filters_products():
+        want = load_filter.wants_product
+    handler, kept = db.mk_insert_product(dbconn, service, want)
+    stats["products"] += db.load_data(dbconn, products, handler, stats=stats)
+    return kept
 
+
+def price_handler(dbconn, price_type, load_filter=None, skus=None):
+    currencies = load_filter.currencies if load_filter is not None else None
+    return db.mk_insert_price(dbconn, price_type, currencies, skus)
+
+
+def sku_filter(skus):
+    return None if skus is None else skus.__contains__
+
+
+def load_prices_on_demand(dbconn, prices, load_filter=None, skus=None, stats=None):
+    if stats is None:
+        stats = metrics.mk_stats(None)
+    # free tiers of products left out can apply to products kept, so every
+    # sku is decoded and only the prices of those left out are dropped
+    handler, applies_tos = price_handler(dbconn, "on_demand", load_filter, skus)
+    stats["prices"] += db.load_data(dbconn, prices, handler, stats=stats)
+    stats["applies_tos"] += len(applies_tos)
+    start = time.perf_counter()
+    db.update_applies(dbconn, applies_tos, "on_demand")
+    stats["write_s"] += time.perf_counter() - start
+
+
+def load_prices_reserved(dbconn, prices, load_filter=None, skus=None, stats=None):
+    if stats is None:
+        stats = metrics.mk_stats(None)
+    handler, _ = price_handler(dbconn, "reserved", load_filter)
+    stats["prices"] += db.load_data(
+        dbconn, prices, handler, sku_filter(skus), stats=stats
+    )
+
+
+def load_offers(db, data, service, load_filter=None, stats=None):
+    """
+    Loads a parsed offer file, which may still be streaming in. Adds what
+    it loaded, and how long that took, to `stats`.
+    """
+    if stats is None:
+        stats = metrics.mk_stats(service)
+    skus = None
     for k, v in data.items():
         if k == 'products':
-            load_products(db, os.path.basename(os.path.dirname(filename)), v)
+            skus = load_products(db, service, v, load_filter, stats)
         elif k == 'terms':
             for k, v in v.items():
+                if load_filter is not None and not load_filter.wants_terms(k):
+                    continue
                 if k == 'OnDemand':
-                    load_prices_on_demand(db, v)
+                    load_prices_on_demand(db, v, load_filter, skus, stats)
                 elif k == 'Reserved':
-                    load_prices_reserved(db, v)
+                    load_prices_reserved(db, v, load_filter, skus, stats)
 
 
-def load_service(db, filename):
+def load_all(db, filename, backend=jsonio.DEFAULT_BACKEND, load_filter=None):
+    """
+    Loads an offer file and returns the `metrics` of loading it
+    """
+    metrics.reset_peak_rss()
+    start = time.perf_counter()
+    service = service_of(filename)
+    stats = metrics.mk_stats(service)
+    with compress.open_read(filename) as f:
+        load_offers(db, jsonio.load(f, backend), service, load_filter, stats)
+    stats["files"] = 1
+    stats["bytes"] = os.path.getsize(filename)
+    stats["wall_s"] = time.perf_counter() - start
+    stats["peak_rss_mb"] = metrics.peak_rss_mb()
+    return stats
+
+
+def load_pipe(
+    db_name,
+    pipe,
+    filename,
+    backend=jsonio.DEFAULT_BACKEND,
+    load_filter=None,
+    collect=None,
+):
+    """
+    Loads the offer file for `filename` from `pipe` while it downloads. Each
+    file goes into a staging database of its own, so several services can
+    load at once, and is merged into `db_name` once all of it has arrived.
+    A stream that fails leaves nothing behind in `db_name`.
+    The `metrics` of a load that finishes are appended to `collect`.
+    """
+    start = time.perf_counter()
+    service = service_of(filename)
+    stats = metrics.mk_stats(service)
+    parent = os.path.dirname(os.path.abspath(db_name))
+    with tempfile.TemporaryDirectory(prefix=".staging-", dir=parent) as staging_dir:
+        staging_name = os.path.join(staging_dir, f"{service}.db")
+        try:
+            offers_data = jsonio.load(pipe, backend)
+            print("#####", service)
+            staging = db.mk_shard_db(staging_name)
+            try:
+                load_offers(staging, offers_data, service, load_filter, stats)
+            finally:
+                staging.close()
+            # let the download finish, eg. trailing whitespace
+            while pipe.read(download.MiB):
+                pass
+        except BaseException:
+            pipe.abandon()
+            raise
+        merged = time.perf_counter()
+        dbconn = db.connect(db_name)
+        try:
+            db.merge_shard(dbconn, staging_name)
+        finally:
+            dbconn.close()
+        stats["merge_s"] = time.perf_counter() - merged
+    if collect is not None:
+        stats["files"] = 1
+        stats["bytes"] = pipe.nread
+        stats["wall_s"] = time.perf_counter() - start
+        stats["peak_rss_mb"] = metrics.peak_rss_mb()
+        collect.append(stats)
+
+
+def load_service(db, filename, backend=jsonio.DEFAULT_BACKEND, load_filter=None):
     """
     Works through resource file by entering everything into sqlite
     """
-    service = os.path.basename(os.path.dirname(filename))
+    service = service_of(filename)
     print("#####", service)
-    load_all(db, filename)
+    return load_all(db, filename, backend, load_filter)
     # load_products(db, filename)
     # load_prices_on_demand(db, filename)
     # load_prices_reserved(db, filename)
+
+
+def load_shard(db_name, filename, backend=jsonio.DEFAULT_BACKEND, load_filter=None):
+    """
+    Loads one offer file into a new database of its own, for `db.merge_shard`
+    to fold into the cache. Runs in a worker process, and returns the
+    `metrics` of the load.
+    """
+    dbconn = db.mk_shard_db(db_name)
+    try:
+        return load_service(dbconn, filename, backend, load_filter)
+    finally:
+        dbconn.close()
+
+
+def load_chunk(db_name, filename, section, start, end, load_filter=None):
+    """
+    Loads the entries of one section chunk from `split.offer_chunks` into a
+    new database of its own. Runs in a worker process, and returns the price
+    containers of the chunk with the `metrics` of the load.
+
+    Free tiers can apply to skus in other chunks, so OnDemand chunks return
+    their price containers for `db.update_applies` to merge once every
+    OnDemand chunk is in. For the same reason chunks of terms keep the
+    terms of products `load_filter` leaves out, `db.delete_unmatched_prices`
+    drops them after the merge.
+    """
+    metrics.reset_peak_rss()
+    began = time.perf_counter()
+    service = service_of(filename)
+    stats = metrics.mk_stats(service)
+    stats["bytes"] = end - start
+    sku_things = split.entries(split.read_chunk(filename, start, end))
+    dbconn = db.mk_shard_db(db_name)
+    try:
+        # the chunk is decoded whole up front
+        stats["parse_s"] = time.perf_counter() - began
+        applies_tos = []
+        if section == "products":
+            load_products(dbconn, service, sku_things, load_filter, stats)
+        else:
+            price_type = "on_demand" if section == "OnDemand" else "reserved"
+            handler, applies_tos = price_handler(dbconn, price_type, load_filter)
+            stats["prices"] += db.load_data(dbconn, sku_things, handler, stats=stats)
+            if section == "OnDemand":
+                stats["applies_tos"] = len(applies_tos)
+            else:
+                applies_tos = []
+    finally:
+        dbconn.close()
+    stats["wall_s"] = time.perf_counter() - began
+    stats["peak_rss_mb"] = metrics.peak_rss_mb()
+    return applies_tos, stats
+
+
+CSV_HEADERS = [
+    "productHash",
+    "sku",
+    "vendorName",
+    "region",
+    "service",
+    "productFamily",
+    "attributes",
+    "prices",
+]
+
+
+def dump_csv(db_name, csvfile, services=None, attributes=None, regions=None):
+    """
+    Writes the products `db.dump_products` picks to `csvfile`, through a
+    read only connection of its own, so several dumps can run at once in
+    worker processes. Returns the rows, size and sha256 of the file.
+    """
+    dbconn = db.connect_readonly(db_name)
+    try:
+        rows = 0
+        with open(csvfile, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file, quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(CSV_HEADERS)
+            for row in db.dump_products(dbconn, services, attributes, regions):
+                writer.writerow(row)
+                rows += 1
+    finally:
+        dbconn.close()
+    return {
+        "rows": rows,
+        "sha256": snapshot.file_digest(csvfile),
+        "size": os.path.getsize(csvfile),
+    }
+
+
+def part_path(csvfile, key):
+    """
+    Where the part of a sharded dump to `csvfile` holding `key` goes, eg.
+    products.us-east-1.csv. Products without a region go to products._.csv
+    """
+    root, ext = os.path.splitext(csvfile)
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", key) or "_"
+    return f"{root}.{name}{ext or '.csv'}"
+
+
+def manifest_path(csvfile):
+    root, _ = os.path.splitext(csvfile)
+    return f"{root}.manifest.json"
+
+
+def save_dump_manifest(csvfile, shard_by, parts):
+    """
+    Writes the manifest of a sharded dump next to its parts, atomically.
+    `parts` maps each part file, relative to the manifest, to its key,
+    rows, size and sha256.
+    """
+    path = manifest_path(csvfile)
+    manifest = {"shardBy": shard_by, "headers": CSV_HEADERS, "parts": parts}
+    jsonio.save(path, manifest)
+    return path
@@ -1,145 +1,938 @@
+import collections
 import datetime
-import json
 import os
+import re
 import sqlite3
 import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import json_stream
 
+from .. import jsonio
+from . import env, metrics
 from . import transforms as t
 
+MiB = 1024 * 1024
+
+# Bumped whenever the tables change, a cache from another version is reloaded
+SCHEMA_VERSION = 5
+
 DB_CREATE = """
 CREATE TABLE products (
     sku TEXT PRIMARY KEY,
     region TEXT,
     service TEXT,
     productFamily TEXT,
-    attributes TEXT,
-    prices TEXT default (json_array())
-)
+    attributes TEXT
+);
+
+CREATE TABLE prices (
+    sku TEXT NOT NULL,
+    rateCode TEXT NOT NULL,
+    effectiveDateStart TEXT,
+    purchaseOption TEXT,
+    unit TEXT,
+    description TEXT,
+    startUsageAmount TEXT,
+    endUsageAmount TEXT,
+    currency TEXT,
+    amount TEXT,
+    termLength TEXT,
+    termPurchaseOption TEXT,
+    termOfferingClass TEXT,
+    freeTier INTEGER NOT NULL DEFAULT 0
+);
+
+-- the offer files each service was last loaded from
+CREATE TABLE sources (
+    service TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    loadedAt TEXT NOT NULL
+);
+
+-- settings the cache was created with
+CREATE TABLE meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+-- attribute names, for compact attributes to refer to by id
+CREATE TABLE attribute_keys (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+
+PRAGMA user_version = %d;
+""" % (SCHEMA_VERSION)
+
+DB_CREATE_INDEXES = """
+-- rowid follows the offer file, so within a sku this is also dump order
+CREATE INDEX prices_sku ON prices (sku);
+"""
+
+# Columns every products table starts with, hot attributes come after them
+PRODUCT_COLUMNS = ["sku", "region", "service", "productFamily", "attributes"]
+
+# Hot attributes become column and index names
+ATTRIBUTE_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+DB_ADD_HOT_COLUMN = """ALTER TABLE products ADD COLUMN "%s" TEXT"""
+
+DB_CREATE_HOT_INDEX = """CREATE INDEX "products_%s" ON products ("%s")"""
+
+# How products.attributes is stored, JSON text or `encode_attributes` blobs
+JSON_ATTRIBUTES = "json"
+COMPACT_ATTRIBUTES = "compact1"
+
+# First byte of every compact attributes blob
+COMPACT_VERSION = 1
+
+DB_SELECT_META = """SELECT value
+    FROM meta
+    WHERE name = ?
+"""
+
+DB_INSERT_META = """INSERT INTO
+    meta (name, value)
+    VALUES (?, ?)
+"""
+
+DB_SELECT_ATTRIBUTE_KEYS = """SELECT id, name
+    FROM attribute_keys
+"""
+
+DB_INSERT_ATTRIBUTE_KEY = """INSERT OR IGNORE INTO
+    attribute_keys (name)
+    VALUES (?)
+"""
+
+DB_SELECT_ATTRIBUTE_KEY = """SELECT id
+    FROM attribute_keys
+    WHERE name = ?
+"""
+
+DB_INSERT_SHARD_ATTRIBUTE_KEYS = """INSERT OR IGNORE INTO
+    attribute_keys (name)
+    SELECT DISTINCT attribute.key
+    FROM shard.products, json_each(shard.products.attributes) AS attribute
+"""
+
+# Settings for building a cache in a scratch file that only replaces the
+# real one once it is complete, so there is nothing for a journal or fsync
+# to protect while loading
+FAST_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    # in KiB, 512 MiB
+    "PRAGMA cache_size = -524288",
+    "PRAGMA mmap_size = 1073741824",
+]
+
+# Shards have no hot columns and keep attributes as JSON, both are taken
+# care of here
+DB_MERGE_PRODUCTS = """INSERT INTO
+    products (sku, region, service, productFamily, attributes%s)
+    SELECT sku, region, service, productFamily, %s%s
+    FROM shard.products
+    ORDER BY rowid
+"""
+
+DB_MERGE_PRICES = """INSERT INTO
+    prices (sku, rateCode, effectiveDateStart, purchaseOption, unit,
+        description, startUsageAmount, endUsageAmount, currency, amount,
+        termLength, termPurchaseOption, termOfferingClass, freeTier)
+    SELECT sku, rateCode, effectiveDateStart, purchaseOption, unit,
+        description, startUsageAmount, endUsageAmount, currency, amount,
+        termLength, termPurchaseOption, termOfferingClass, freeTier
+    FROM shard.prices
+    ORDER BY rowid
+"""
+
+DB_DELETE_SERVICE_PRICES = """DELETE FROM prices
+    WHERE sku IN (SELECT sku FROM products WHERE service = ?)
+        OR sku IN (SELECT sku FROM shard.prices)
+"""
+
+DB_DELETE_SERVICE_PRODUCTS = """DELETE FROM products
+    WHERE service = ?
+        OR sku IN (SELECT sku FROM shard.products)
+"""
+
+DB_DELETE_UNMATCHED_PRICES = """DELETE FROM prices
+    WHERE sku NOT IN (SELECT sku FROM products)
+"""
+
+DB_SELECT_SOURCES = """SELECT service, digest
+    FROM sources
+"""
+
+DB_REPLACE_SOURCE = """INSERT OR REPLACE INTO
+    sources (service, digest, loadedAt)
+    VALUES (?, ?, ?)
+"""
+
+DB_COUNT_ROWS = """SELECT
+    (SELECT count(*) FROM products),
+    (SELECT count(*) FROM prices)
 """
 
 DB_INSERT_PRODUCT = """INSERT INTO
-    products (sku, region, service, productFamily, attributes)
-    VALUES (?, ?, ?, ?, ?)
+    products (sku, region, service, productFamily, attributes%s)
+    VALUES (?, ?, ?, ?, ?%s)
 """
 
-DB_SELECT_SKUS = """SELECT sku, attributes, prices
-    FROM products
-    WHERE sku in (%s)
+DB_INSERT_PRICE = """INSERT INTO
+    prices (sku, rateCode, effectiveDateStart, purchaseOption, unit,
+        description, startUsageAmount, endUsageAmount, currency, amount,
+        termLength, termPurchaseOption, termOfferingClass, freeTier)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 """
 
-DB_DUMP_ALL = """SELECT
-    '', sku, 'aws', region, service,  productFamily, attributes, prices
-    FROM products
+DB_CREATE_APPLIES = """CREATE TEMP TABLE applies (
+    seq INTEGER PRIMARY KEY,
+    sku TEXT,
+    rateCode TEXT,
+    effectiveDateStart TEXT,
+    purchaseOption TEXT,
+    unit TEXT,
+    description TEXT,
+    startUsageAmount TEXT,
+    endUsageAmount TEXT,
+    currency TEXT,
+    amount TEXT,
+    termLength TEXT,
+    termPurchaseOption TEXT,
+    termOfferingClass TEXT
+)
 """
 
-DB_ADD_PRICE = """UPDATE products
-    SET prices = json_insert(prices, '$[#]', ?)
-    WHERE sku = ?
+DB_INSERT_APPLIES = """INSERT INTO
+    applies (sku, rateCode, effectiveDateStart, purchaseOption, unit,
+        description, startUsageAmount, endUsageAmount, currency, amount,
+        termLength, termPurchaseOption, termOfferingClass)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 """
 
-DB_SELECT_PRICES = """SELECT sku, prices
-    FROM products
-    WHERE sku = ?
+DB_INDEX_APPLIES = """CREATE INDEX temp.applies_sku ON applies (sku, seq)
+"""
+
+DB_CREATE_START_TIERS = """CREATE TEMP TABLE start_tiers (
+    price_id INTEGER PRIMARY KEY,
+    sku TEXT,
+    startUsageAmount TEXT,
+    freeEnd TEXT
+)
+"""
+
+DB_INSERT_START_TIERS = """INSERT INTO
+    start_tiers (price_id, sku, startUsageAmount, freeEnd)
+    SELECT
+        firsts.price_id,
+        firsts.sku,
+        prices.startUsageAmount,
+        (
+            SELECT endUsageAmount
+            FROM applies
+            WHERE applies.sku = firsts.sku
+            ORDER BY applies.seq
+            LIMIT 1
+        ) AS freeEnd
+    FROM (
+        SELECT sku, min(rowid) AS price_id
+        FROM prices
+        WHERE sku IN (SELECT sku FROM applies)
+            AND sku IN (SELECT sku FROM products)
+            AND freeTier = 0
+        GROUP BY sku
+    ) AS firsts
+    JOIN prices ON prices.rowid = firsts.price_id
+"""
+
+DB_SELECT_NO_START_TIER = """SELECT sku
+    FROM start_tiers
+    WHERE startUsageAmount IS NOT '0'
+"""
+
+DB_DELETE_NO_START_TIER = """DELETE FROM start_tiers
+    WHERE startUsageAmount IS NOT '0'
+"""
+
+DB_INSERT_FREE_TIERS = """INSERT INTO
+    prices (sku, rateCode, effectiveDateStart, purchaseOption, unit,
+        description, startUsageAmount, endUsageAmount, currency, amount,
+        termLength, termPurchaseOption, termOfferingClass, freeTier)
+    SELECT applies.sku, applies.rateCode, applies.effectiveDateStart,
+        applies.purchaseOption, applies.unit, applies.description,
+        applies.startUsageAmount, applies.endUsageAmount, applies.currency,
+        applies.amount, applies.termLength, applies.termPurchaseOption,
+        applies.termOfferingClass, 1
+    FROM applies
+    JOIN start_tiers ON start_tiers.sku = applies.sku
+    ORDER BY applies.seq
+"""
+
+DB_MERGE_START_TIERS = """UPDATE prices
+    SET startUsageAmount = (
+        SELECT freeEnd FROM start_tiers WHERE start_tiers.price_id = prices.rowid
+    )
+    WHERE rowid IN (SELECT price_id FROM start_tiers)
+"""
+
+DB_DROP_APPLIES = """DROP TABLE temp.applies
 """
 
-DB_REPLACE_PRICES = """UPDATE products
-    SET prices = ?
-    WHERE sku = ?
+DB_DROP_START_TIERS = """DROP TABLE temp.start_tiers
 """
 
+# A price as the JSON text jsonio.dumps makes of `t.price_from_row`, keys
+# in the same order. json_quote leaves characters past "~" as they are,
+# where jsonio.dumps escapes them.
+DB_PRICE_JSON = """'{"effectiveDateStart": ' || json_quote(effectiveDateStart)
+    || ', "purchaseOption": ' || json_quote(purchaseOption)
+    || ', "unit": ' || json_quote(unit)
+    || ', "description": ' || json_quote(description)
+    || CASE WHEN startUsageAmount IS NULL THEN ''
+        ELSE ', "startUsageAmount": ' || json_quote(startUsageAmount) END
+    || CASE WHEN endUsageAmount IS NULL THEN ''
+        ELSE ', "endUsageAmount": ' || json_quote(endUsageAmount) END
+    || CASE WHEN currency IS NULL THEN ''
+        ELSE ', ' || json_quote(currency) || ': ' || json_quote(amount) END
+    || CASE WHEN termLength IS NULL THEN ''
+        ELSE ', "termLength": ' || json_quote(termLength) END
+    || CASE WHEN termPurchaseOption IS NULL THEN ''
+        ELSE ', "termPurchaseOption": ' || json_quote(termPurchaseOption) END
+    || CASE WHEN termOfferingClass IS NULL THEN ''
+        ELSE ', "termOfferingClass": ' || json_quote(termOfferingClass) END
+    || '}'"""
+
+# Products as CSV rows, prices formatted as `t.price_csv_format` would.
+# The ORDER BY keeps group_concat in offer file order.
 DB_DUMP = """SELECT
-    sku, region, service, productFamily, attributes, prices
+    '', sku, 'aws', region, service, productFamily, attributes,
+    (SELECT '{"aoc_for_prez_2028": [' || coalesce(group_concat(price, ', '), '')
+        || ']}'
+        FROM (SELECT %s AS price
+            FROM prices
+            WHERE prices.sku = products.sku AND prices.freeTier = 0
+            ORDER BY prices.rowid))
+    FROM products
+    %%s
+    ORDER BY products.rowid
+""" % (DB_PRICE_JSON)
+
+DB_DUMP_PRICES = """SELECT
+    effectiveDateStart, purchaseOption, unit, description, startUsageAmount,
+    endUsageAmount, currency, amount, termLength, termPurchaseOption,
+    termOfferingClass
+    FROM prices
+    WHERE sku = ? AND freeTier = 0
+    ORDER BY rowid
+"""
+
+DB_SELECT_SERVICES = """SELECT DISTINCT service
+    FROM products
+"""
+
+# Columns `aws dump --shard-by` can split products on
+SHARD_COLUMNS = ["service", "region"]
+
+DB_COUNT_SHARDS = """SELECT "%s", count(*)
     FROM products
+    %s
+    GROUP BY 1
 """
 
 
+# Seconds a connection waits for another one to finish writing
+BUSY_TIMEOUT = 600
+
+# Rough bytes of rows collected before they are queued for the writer thread
+BATCH_BYTES = 8 * MiB
+
+# Batches allowed to wait for the writer thread before parsing pauses
+WRITE_QUEUE_DEPTH = 4
+
+
 def connect(filename):
     if os.path.exists(filename):
-        db = sqlite3.connect(filename, isolation_level=None)
+        db = sqlite3.connect(
+            filename,
+            isolation_level=None,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+        )
         return db
 
 
-def mk_db(filename):
+def connect_readonly(filename):
+    """
+    Opens an existing cache for reading only, eg. from several dump workers
+    at once
+    """
+    path = urllib.parse.quote(os.path.abspath(filename))
+    return sqlite3.connect(
+        f"file:{path}?mode=ro", uri=True, isolation_level=None, timeout=BUSY_TIMEOUT
+    )
+
+
+def check_hot_attributes(names):
+    """
+    Returns `names` without repeats, after making sure each can be a column
+    of products. SQLite column names ignore case, so names may not differ
+    from the built-in columns or from each other by case alone.
+    """
+    names = list(dict.fromkeys(names))
+    taken = {column.lower() for column in PRODUCT_COLUMNS}
+    for name in names:
+        if not ATTRIBUTE_RE.match(name) or name.lower() in taken:
+            raise ValueError(f"Cannot make a column of attribute {name!r}")
+        taken.add(name.lower())
+    return names
+
+
+def hot_attributes(db):
+    """
+    The attributes `db` keeps in columns of their own.
+    """
+    columns = [row[1] for row in db.execute("PRAGMA table_info(products)")]
+    return columns[len(PRODUCT_COLUMNS) :]
+
+
+def mk_db(filename, fast=False, hot_attributes=None, compact_attributes=False):
+    """
+    Creates a new cache, with a column for each of `hot_attributes`,
+    `env.HOT_ATTRIBUTES` by default, and attributes stored as JSON or, with
+    `compact_attributes`, as blobs from `mk_attribute_codec`. A `fast`
+    cache is built with `FAST_PRAGMAS` and without secondary indexes,
+    `finish_db` adds them once the rows are in.
+    """
+    if hot_attributes is None:
+        hot_attributes = env.HOT_ATTRIBUTES
+    hot_attributes = check_hot_attributes(hot_attributes)
     if connect(filename):
         sys.stderr.write("ERROR: db file already exists %s" % (filename))
         sys.exit(-1)
-    db = sqlite3.connect(filename, isolation_level=None)
-    db.execute(DB_CREATE)
-    db.commit()
+    db = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+    if fast:
+        for pragma in FAST_PRAGMAS:
+            db.execute(pragma)
+    db.executescript(DB_CREATE)
+    encoding = COMPACT_ATTRIBUTES if compact_attributes else JSON_ATTRIBUTES
+    db.execute(DB_INSERT_META, ("attributes", encoding))
+    for name in hot_attributes:
+        db.execute(DB_ADD_HOT_COLUMN % name)
+    if not fast:
+        create_indexes(db)
     return db
 
 
-def mk_insert_product(db, service):
-    def handler(sku_products):
-        rows = []
-        for sku, product in sku_products:
-            productFamily = product.get("productFamily", "")
-            region = product["attributes"].get("regionCode", "")
-            attributes = json.dumps(product["attributes"])
-            rows.append((sku, region, service, productFamily, attributes))
-        db.executemany(DB_INSERT_PRODUCT, rows)
+def mk_shard_db(filename):
+    """
+    Creates a fast cache for one worker's or one service's rows, to be
+    folded into the cache with `merge_shard` or `replace_service`. It has
+    no hot columns, they are filled from the attributes when it is merged.
+    """
+    return mk_db(filename, fast=True, hot_attributes=[])
+
+
+def create_indexes(db):
+    db.executescript(DB_CREATE_INDEXES)
+    for name in hot_attributes(db):
+        db.execute(DB_CREATE_HOT_INDEX % (name, name))
+
+
+def finish_db(db):
+    create_indexes(db)
+
+
+def attributes_encoding(db):
+    row = db.execute(DB_SELECT_META, ("attributes",)).fetchone()
+    return row[0] if row else JSON_ATTRIBUTES
+
+
+def put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def get_varint(blob, pos):
+    n = shift = 0
+    while True:
+        byte = blob[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def mk_attribute_codec(db):
+    """
+    Returns functions to turn `attribute_pairs` into compact blobs and
+    blobs back into the JSON text a JSON cache would hold.
+
+    A blob is `COMPACT_VERSION` followed by the id of the key, the length
+    of the value and the value as JSON for each attribute in order. Keys
+    are named once, in attribute_keys. New keys are added there as they
+    are met, so encoding has to happen in a write transaction.
+    """
+    ids = {}
+    # id to the key as JSON
+    keys = {}
+
+    def refresh():
+        for key_id, name in db.execute(DB_SELECT_ATTRIBUTE_KEYS):
+            ids[name] = key_id
+            keys[key_id] = jsonio.dumps(name)
+
+    def key_id(name):
+        if name not in ids:
+            db.execute(DB_INSERT_ATTRIBUTE_KEY, (name,))
+            (ids[name],) = db.execute(DB_SELECT_ATTRIBUTE_KEY, (name,)).fetchone()
+        return ids[name]
+
+    def encode(pairs):
+        out = bytearray([COMPACT_VERSION])
+        for name, value in pairs:
+            put_varint(out, key_id(name))
+            put_varint(out, len(value))
+            out += value
+        return bytes(out)
 
-    return handler
+    def decode(blob):
+        if blob[0] != COMPACT_VERSION:
+            raise ValueError(f"Unknown compact attributes version {blob[0]}")
+        pairs = []
+        pos = 1
+        while pos < len(blob):
+            key, pos = get_varint(blob, pos)
+            size, pos = get_varint(blob, pos)
+            if key not in keys:
+                refresh()
+            pairs.append(f"{keys[key]}: {blob[pos : pos + size].decode()}")
+            pos += size
+        return "{" + ", ".join(pairs) + "}"
 
+    refresh()
+    return encode, decode
 
-def mk_insert_price(db, price_type):
+
+def attribute_pairs(attributes):
+    """
+    The names of `attributes` with their values as JSON, the part of
+    compact encoding that needs no database
+    """
+    return [(name, jsonio.dumps(value).encode()) for name, value in attributes.items()]
+
+
+def merge_products_sql(db):
+    """
+    Builds the statement copying products from an attached shard. For a
+    compact cache it first adds the keys of the shard to attribute_keys,
+    then registers `encode_attributes` knowing all of them. A JSON cache
+    has no use for attribute_keys.
+    """
+    names = hot_attributes(db)
+    columns = "".join(f', "{name}"' for name in names)
+    values = "".join(f", json_extract(attributes, '$.{name}')" for name in names)
+    attributes = "attributes"
+    if attributes_encoding(db) == COMPACT_ATTRIBUTES:
+        db.execute(DB_INSERT_SHARD_ATTRIBUTE_KEYS)
+        encode, _ = mk_attribute_codec(db)
+        db.create_function(
+            "encode_attributes",
+            1,
+            lambda text: encode(attribute_pairs(jsonio.loads(text))),
+        )
+        attributes = "encode_attributes(attributes)"
+    return DB_MERGE_PRODUCTS % (columns, attributes, values)
+
+
+def merge_products(db):
+    db.execute(merge_products_sql(db))
+
+
+def merge_shard(db, shard_name):
+    """
+    Appends the rows of the shard database `shard_name`, keeping their
+    order, so merging shards in file order matches a sequential load.
+    """
+    db.execute("ATTACH DATABASE ? AS shard", (shard_name,))
+    try:
+        db.execute("BEGIN IMMEDIATE;")
+        merge_products(db)
+        db.execute(DB_MERGE_PRICES)
+        db.commit()
+    finally:
+        if db.in_transaction:
+            db.rollback()
+        db.execute("DETACH DATABASE shard")
+
+
+def replace_service(db, shard_name, service, digest):
+    """
+    Swaps the rows of `service` for those in the shard database
+    `shard_name` and records `digest` as its source, all in one
+    transaction, so an interrupted load leaves the service as it was.
+
+    Prices go with the products of the service and with the skus the shard
+    prices. Prices an older offer file had for skus without a product, and
+    the new one dropped, stay behind, but never make it into a dump.
+    """
+    db.execute("ATTACH DATABASE ? AS shard", (shard_name,))
+    try:
+        db.execute("BEGIN IMMEDIATE;")
+        db.execute(DB_DELETE_SERVICE_PRICES, (service,))
+        db.execute(DB_DELETE_SERVICE_PRODUCTS, (service,))
+        merge_products(db)
+        db.execute(DB_MERGE_PRICES)
+        loaded_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        db.execute(DB_REPLACE_SOURCE, (service, digest, loaded_at))
+        db.commit()
+    finally:
+        if db.in_transaction:
+            db.rollback()
+        db.execute("DETACH DATABASE shard")
+
+
+def delete_unmatched_prices(db):
+    """
+    Drops prices for skus without a product, eg. those of products a load
+    filter left out.
+    """
+    db.execute("BEGIN IMMEDIATE;")
+    db.execute(DB_DELETE_UNMATCHED_PRICES)
+    db.commit()
+
+
+def sources(db):
+    """
+    Maps each service to the digest of the offer files it was loaded from.
+    """
+    return dict(db.execute(DB_SELECT_SOURCES))
+
+
+def record_sources(db, digests):
+    loaded_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    db.execute("BEGIN IMMEDIATE;")
+    db.executemany(
+        DB_REPLACE_SOURCE,
+        [(service, digest, loaded_at) for service, digest in digests.items()],
+    )
+    db.commit()
+
+
+def count_rows(db):
+    return db.execute(DB_COUNT_ROWS).fetchone()
+
+
+def check_version(db, filename):
+    (version,) = db.execute("PRAGMA user_version").fetchone()
+    if version != SCHEMA_VERSION:
+        sys.stderr.write(
+            "ERROR: db file %s has schema version %d, not %d, run aws load again\n"
+            % (filename, version, SCHEMA_VERSION)
+        )
+        sys.exit(-1)
+
+
+def row_bytes(row):
+    return sum(len(v) if isinstance(v, str) else 8 for v in row)
+
+
+def mk_insert_product(db, service, want=None):
+    """
+    Returns a handler inserting products, and the set of skus it inserted
+    when `want` is given to pick the products to keep.
+    """
+    kept = None if want is None else set()
+    hot = hot_attributes(db)
+    columns = "".join(f', "{name}"' for name in hot)
+    insert_product = DB_INSERT_PRODUCT % (columns, ", ?" * len(hot))
+    encode = None
+    if attributes_encoding(db) == COMPACT_ATTRIBUTES:
+        encode, _ = mk_attribute_codec(db)
+
+    def convert(sku, product):
+        if want is not None:
+            if not want(product):
+                return [], 0
+            kept.add(sku)
+        productFamily = product.get("productFamily", "")
+        region = product["attributes"].get("regionCode", "")
+        if encode is None:
+            attributes = jsonio.dumps(product["attributes"])
+            size = len(attributes)
+        else:
+            # key ids come from the database, the writer thread adds them
+            attributes = attribute_pairs(product["attributes"])
+            size = sum(len(name) + len(value) for name, value in attributes)
+        row = (sku, region, service, productFamily, attributes)
+        row += tuple(product["attributes"].get(n) for n in hot)
+        return [row], size + row_bytes(row[:4])
+
+    def write(rows):
+        if encode is not None:
+            rows = [row[:4] + (encode(row[4]),) + row[5:] for row in rows]
+        db.executemany(insert_product, rows)
+
+    return (convert, write), kept
+
+
+def mk_insert_price(db, price_type, currencies=None, skus=None):
+    """
+    Returns a handler inserting prices, and the list its price containers
+    go to. With `skus`, only the prices of those skus are inserted, while
+    containers are kept whatever sku they come with, for the skus they
+    apply to may well be among them.
+    """
     applies_tos = []
 
-    def handler(sku_prices):
-        for sku, prices in sku_prices:
-            for price in prices.values():
-                price_dim = t.get_single(price["priceDimensions"])
-                if "appliesTo" in price_dim and len(price_dim["appliesTo"]) > 0:
-                    # dont add entry for price containers (eg. list in appliesto)
+    def wanted(row):
+        return currencies is None or row[t.PRICE_ROW_CURRENCY] in currencies
+
+    def convert(sku, prices):
+        rows = []
+        size = 0
+        for price in prices.values():
+            price_dim = t.get_single(price["priceDimensions"])
+            if "appliesTo" in price_dim and len(price_dim["appliesTo"]) > 0:
+                # dont add entry for price containers (eg. list in appliesto)
+                ato_p = next(t.flatten_prices(price, price_type))
+                if wanted(t.price_row(ato_p)):
                     applies_tos.append(price)
-                else:
-                    for flat_p in t.flatten_prices(price, price_type):
-                        db.execute(DB_ADD_PRICE, (json.dumps(flat_p), sku))
+            elif skus is None or sku in skus:
+                for flat_p in t.flatten_prices(price, price_type):
+                    row = t.price_row(flat_p)
+                    if wanted(row):
+                        rows.append((sku,) + row + (0,))
+                        size += row_bytes(row)
+        return rows, size
 
-    return handler, applies_tos
+    def write(rows):
+        db.executemany(DB_INSERT_PRICE, rows)
 
+    return (convert, write), applies_tos
 
-def load_data(db, data, handler):
-    db.execute("BEGIN TRANSACTION;")
-    batch = []
-    for idx, (sku, thing) in enumerate(data.items()):
-        batch.append((sku, json_stream.to_standard_types(thing)))
-        if idx % 50000 == 0:
-            handler(batch)
-            batch = []
-    handler(batch)
+
+def write_batch(db, write, rows):
+    # IMMEDIATE takes the write lock up front, so connections loading other
+    # services wait for it instead of failing to upgrade a read lock
+    db.execute("BEGIN IMMEDIATE;")
+    try:
+        write(rows)
+    except BaseException:
+        db.rollback()
+        raise
     db.commit()
+
+
+class BatchWriter:
+    """
+    Writes batches of rows from a dedicated thread, each in a transaction of
+    its own, so parsing the next batch goes on while SQLite writes the last
+    one. At most `depth` batches are queued; beyond that `write` waits for
+    SQLite. An error writing is raised from `write` or `flush`.
+
+    The connection belongs to the writer thread until `flush` returns, and
+    so does `busy`, the seconds spent writing.
+    """
+
+    def __init__(self, db, write, depth=WRITE_QUEUE_DEPTH):
+        self.db = db
+        self.write_rows = write
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = collections.deque()
+        self.busy = 0.0
+
+    def write_timed(self, rows):
+        start = time.perf_counter()
+        try:
+            write_batch(self.db, self.write_rows, rows)
+        finally:
+            self.busy += time.perf_counter() - start
+
+    def write(self, rows):
+        while len(self.pending) >= self.depth:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(self.write_timed, rows))
+
+    def flush(self):
+        while self.pending:
+            self.pending.popleft().result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        try:
+            if exc_type is None:
+                self.flush()
+            else:
+                # the parse failed, batches not started yet are dropped
+                for future in self.pending:
+                    future.cancel()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+def load_data(db, data, handler, want=None, stats=None):
+    """
+    Feeds the entries of `data` to `handler`, a (convert, write) pair from
+    the `mk_insert_` functions. Entries are converted to rows as they are
+    parsed, and about `BATCH_BYTES` of rows at a time go to a `BatchWriter`.
+    Entries whose sku `want` turns down are skipped before they are decoded.
+
+    Returns the number of rows written. Where the time went is added to
+    `stats`, from `metrics.mk_stats`.
+    """
+    if stats is None:
+        stats = metrics.mk_stats(None)
+    convert, write = handler
+    batch = []
+    size = 0
+    count = 0
+    # sections can be empty, eg. no reserved terms in a region's file
+    idx = -1
+    clock = time.perf_counter
+    mark = clock()
+    with BatchWriter(db, write) as writer:
+        for idx, (sku, thing) in enumerate(data.items()):
+            if want is not None and not want(sku):
+                continue
+            thing = json_stream.to_standard_types(thing)
+            now = clock()
+            stats["parse_s"] += now - mark
+            rows, nbytes = convert(sku, thing)
+            mark = clock()
+            stats["flatten_s"] += mark - now
+            batch += rows
+            size += nbytes
+            count += len(rows)
+            if size >= BATCH_BYTES:
+                writer.write(batch)
+                batch = []
+                size = 0
+                now = clock()
+                stats["wait_s"] += now - mark
+                mark = now
+        now = clock()
+        stats["parse_s"] += now - mark
+        mark = now
+        if batch:
+            writer.write(batch)
+        writer.flush()
+    stats["wait_s"] += clock() - mark
+    stats["write_s"] += writer.busy
     print(f"{datetime.datetime.now().isoformat()} :: {idx + 1}")
+    return count
 
 
 def update_applies(db, applies_tos, price_type):
+    """
+    Merges free tiers into the prices they apply to. For every product
+    whose first price starts at zero usage, that price now starts where
+    the first free tier for it ends, and each free tier for it is kept as
+    a freeTier row.
+
+    The pairs of free tier and product go into a temp table and are merged
+    with a few set based statements in a single transaction.
+    """
     if not applies_tos:
         return
+    rows = []
     for ato in applies_tos:
         ato_dim = t.get_single(ato["priceDimensions"])
-        matching_skus = ato_dim["appliesTo"]
-        ato_flat = next(t.flatten_prices(ato, price_type))
-        db.execute("BEGIN TRANSACTION;")
-        for sku, _, prices in find_skus(db, matching_skus):
-            t.merge_start_tier(prices, ato_flat)
-            prices = [json.dumps(price) for price in prices]
-            db.execute(DB_REPLACE_PRICES, (json.dumps(prices), sku))
-        db.commit()
+        ato_row = t.price_row(next(t.flatten_prices(ato, price_type)))
+        for sku in dict.fromkeys(ato_dim["appliesTo"]):
+            rows.append((sku,) + ato_row)
+
+    db.execute("BEGIN IMMEDIATE;")
+    db.execute(DB_CREATE_APPLIES)
+    db.executemany(DB_INSERT_APPLIES, rows)
+    db.execute(DB_INDEX_APPLIES)
+    db.execute(DB_CREATE_START_TIERS)
+    db.execute(DB_INSERT_START_TIERS)
+    for (sku,) in db.execute(DB_SELECT_NO_START_TIER).fetchall():
+        print("NO START TIER:", sku)
+    db.execute(DB_DELETE_NO_START_TIER)
+    db.execute(DB_INSERT_FREE_TIERS)
+    db.execute(DB_MERGE_START_TIERS)
+    db.execute(DB_DROP_APPLIES)
+    db.execute(DB_DROP_START_TIERS)
+    db.commit()
+
+
+def services(db):
+    return [service for (service,) in db.execute(DB_SELECT_SERVICES)]
+
+
+def shard_sizes(db, column, services=None):
+    """
+    Maps each value of `column`, one of `SHARD_COLUMNS`, to its number of
+    products among `services`, or every service
+    """
+    if column not in SHARD_COLUMNS:
+        raise ValueError(f"Cannot shard on {column}")
+    where, params = "", []
+    if services is not None:
+        where = "WHERE service in (%s)" % ",".join(["?"] * len(services))
+        params = services
+    return dict(db.execute(DB_COUNT_SHARDS % (column, where), params))
 
 
-def find_skus(db, skus):
-    qmarks = ",".join(["?"] * len(skus))
-    query = DB_SELECT_SKUS % qmarks
-    products = db.execute(query, skus)
-    for sku, prod_attrs, prices in products:
-        # convert inner encoding
-        p_data = json.loads(prices)
-        p_data = list(map(lambda p: json.loads(p), p_data))
-        yield sku, prod_attrs, p_data
+def dump_products(db, services=None, attributes=None, regions=None):
+    """
+    Yields each product as a CSV row, with its prices as JSON in the last
+    column. SQLite builds the JSON, Python only steps in for prices with
+    characters jsonio.dumps escapes. Free tiers merged in by
+    `update_applies` are left out.
 
+    Only products of `services` and `regions` are dumped, when given.
+    `attributes` maps attribute names to the value products must have.
+    Hot attributes are looked up in their indexes, others in the
+    attributes JSON of every product.
+    """
+    decode = None
+    if attributes_encoding(db) == COMPACT_ATTRIBUTES:
+        _, decode = mk_attribute_codec(db)
+        db.create_function("decode_attributes", 1, decode)
 
-def dump_products(db):
-    for row in db.execute(DB_DUMP_ALL):
-        yield row
+    conditions, params = [], []
+    if services is not None:
+        qmarks = ",".join(["?"] * len(services))
+        conditions.append(f"service in ({qmarks})")
+        params.extend(services)
+    if regions is not None:
+        qmarks = ",".join(["?"] * len(regions))
+        conditions.append(f"region in ({qmarks})")
+        params.extend(regions)
+    hot = hot_attributes(db)
+    for name, value in (attributes or {}).items():
+        if name in hot:
+            conditions.append(f'products."{name}" = ?')
+        elif decode is not None:
+            conditions.append("json_extract(decode_attributes(attributes), ?) = ?")
+            params.append(f'$."{name}"')
+        else:
+            conditions.append("json_extract(attributes, ?) = ?")
+            params.append(f'$."{name}"')
+        params.append(value)
+    where = ""
+    if conditions:
+        where = "WHERE " + " AND ".join(conditions)
+    for row in db.execute(DB_DUMP % where, params):
+        attributes, prices = row[6:]
+        if decode is not None:
+            attributes = decode(attributes)
+        if not prices.isascii() or "\x7f" in prices:
+            rows = db.execute(DB_DUMP_PRICES, (row[1],))
+            prices = t.price_csv_format([t.price_from_row(r) for r in rows])
+        yield row[:6] + (attributes, prices)
@@ -9,6 +9,18 @@ NOISES_DB = os.path.join(NOISES_ROOT, "cache.db")
 # Default location for CSV produced at end of this module's processes
 NOISES_CSV = os.path.join(NOISES_ROOT, "products.csv")
 
+# Product attributes that also get an indexed column of their own, for
+# filtering without parsing the attributes JSON
+HOT_ATTRIBUTES = [
+    "servicecode",
+    "usagetype",
+    "operation",
+    "instanceType",
+    "volumeApiName",
+    "group",
+    "databaseEngine",
+]
+
 # Path to AWS host that supplies the pricing data
 PRICE_API = "https://pricing.us-east-1.amazonaws.com"
 
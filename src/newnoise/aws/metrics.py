@@ -0,0 +1,135 @@
+import json
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MiB = 1024 * 1024
+
+# Counted while loading
+COUNTERS = ["files", "bytes", "products", "prices", "applies_tos"]
+
+# Seconds spent parsing offer files, flattening entries into rows, writing
+# rows on the writer thread, waiting for that thread, merging shards and in
+# all for a service. Writing overlaps with parsing, so the parts can add up
+# to more than the whole.
+TIMERS = ["parse_s", "flatten_s", "write_s", "wait_s", "merge_s", "wall_s"]
+
+# Where Linux keeps the resident memory high-water mark, and resets it
+PROC_STATUS = "/proc/self/status"
+CLEAR_REFS = "/proc/self/clear_refs"
+
+SUMMARY_HEADERS = [
+    "service",
+    "MiB",
+    "products",
+    "prices",
+    "parse",
+    "flatten",
+    "write",
+    "wait",
+    "merge",
+    "wall",
+    "peakMiB",
+]
+
+
+def mk_stats(service):
+    """
+    Metrics of loading `service`, or a part of it. Plain dicts, so they
+    come back from worker processes and go out as JSON as they are.
+    """
+    stats = {"service": service}
+    stats.update((name, 0) for name in COUNTERS)
+    stats.update((name, 0.0) for name in TIMERS)
+    stats["peak_rss_mb"] = 0.0
+    return stats
+
+
+def reset_peak_rss():
+    """
+    Starts the high-water mark of `peak_rss_mb` over from what the process
+    holds now. Pool workers are reused, so a task that does this reports
+    its own peak rather than that of the largest task the worker ran
+    before. Only Linux allows it, elsewhere the peak stays the process's.
+    """
+    try:
+        with open(CLEAR_REFS, "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    High-water resident memory of this process since it started or since
+    `reset_peak_rss`, 0 where unknown
+    """
+    try:
+        with open(PROC_STATUS) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        rss /= 1024
+    return rss / 1024
+
+
+def add(total, part):
+    """
+    Adds the metrics of `part` to `total`. Peak memory is the highest of
+    the two, parts may have loaded in different processes.
+    """
+    for name in COUNTERS + TIMERS:
+        total[name] += part[name]
+    total["peak_rss_mb"] = max(total["peak_rss_mb"], part["peak_rss_mb"])
+    return total
+
+
+def by_service(parts):
+    """
+    Sums metrics of parts, eg. files or chunks, per service, most costly
+    service first
+    """
+    services = {}
+    for part in parts:
+        service = part["service"]
+        if service not in services:
+            services[service] = mk_stats(service)
+        add(services[service], part)
+    return sorted(services.values(), key=lambda s: s["wall_s"], reverse=True)
+
+
+def write_jsonl(path, services):
+    with open(path, "w") as f:
+        for stats in services:
+            f.write(json.dumps(stats) + "\n")
+
+
+def print_summary(services):
+    print("%-28s %9s %9s %9s %7s %7s %7s %7s %7s %7s %7s" % tuple(SUMMARY_HEADERS))
+    for s in services:
+        print(
+            "%-28s %9.1f %9d %9d %7.1f %7.1f %7.1f %7.1f %7.1f %7.1f %7.0f"
+            % (
+                s["service"],
+                s["bytes"] / MiB,
+                s["products"],
+                s["prices"],
+                s["parse_s"],
+                s["flatten_s"],
+                s["write_s"],
+                s["wait_s"],
+                s["merge_s"],
+                s["wall_s"],
+                s["peak_rss_mb"],
+            )
+        )
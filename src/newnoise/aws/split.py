@@ -0,0 +1,134 @@
+import json
+import mmap
+import os
+import re
+
+from .. import compress
+
+MiB = 1024 * 1024
+
+# Uncompressed offer files at least this big are split up for `aws load -j`
+SPLIT_SIZE = 128 * MiB
+
+# Target bytes of JSON parsed by one worker at a time
+CHUNK_SIZE = 32 * MiB
+
+# What follows the key of an object
+OPEN_RE = re.compile(rb"\s*:\s*\{")
+
+# Start of an entry in each section. A product is keyed by the sku it
+# repeats as its first field, and a sku's terms are keyed by offer codes
+# that start with the sku, so nested objects never look like entries.
+ENTRY_RES = {
+    "products": re.compile(rb'"([^"]+)"\s*:\s*\{\s*"sku"\s*:\s*"\1"'),
+    "OnDemand": re.compile(rb'"([^".]+)"\s*:\s*\{\s*"\1\.'),
+    "Reserved": re.compile(rb'"([^".]+)"\s*:\s*\{\s*"\1\.'),
+}
+
+# A key and its colon, after the comma ending the previous entry
+KEY_RE = re.compile(r'\s*,?\s*"([^"\\]*)"\s*:\s*')
+
+
+def splittable(filename):
+    return (
+        compress.compression_of(filename) is None
+        and os.path.getsize(filename) >= SPLIT_SIZE
+    )
+
+
+def find_object(mm, key, pos=0):
+    """
+    Returns the span from `key` to just inside the brace opening its
+    object, or None. mm.find keeps this at memchr speed across gigabytes,
+    where a regex would try every offset.
+    """
+    needle = b'"%s"' % key.encode()
+    while (i := mm.find(needle, pos)) != -1:
+        # a quote inside a string is escaped
+        m = OPEN_RE.match(mm, i + len(needle))
+        if m and mm[i - 1 : i] != b"\\":
+            return i, m.end()
+        pos = i + 1
+    return None
+
+
+def sections(mm):
+    """
+    Finds the products, OnDemand and Reserved objects in a mapped offer
+    file. Returns (name, start, end) for each in file order, where start is
+    just inside the opening brace and end is no further than the next
+    section, or the end of the file.
+
+    Top level keys never hold these as objects anywhere else, and the kinds
+    of terms only count inside terms.
+    """
+    found = {}
+    products = find_object(mm, "products")
+    if products:
+        found["products"] = products
+    terms = find_object(mm, "terms")
+    if terms:
+        for name in ("OnDemand", "Reserved"):
+            span = find_object(mm, name, terms[1])
+            if span:
+                found[name] = span
+
+    starts = [span[0] for span in found.values()]
+    if terms:
+        starts.append(terms[0])
+    spans = []
+    for name, (key_start, start) in sorted(found.items(), key=lambda item: item[1]):
+        end = min((s for s in starts if s > key_start), default=len(mm))
+        spans.append((name, start, end))
+    return spans
+
+
+def chunk_bounds(mm, start, end, entry_re, chunk_size=CHUNK_SIZE):
+    """
+    Cuts mm[start:end] into ranges of about `chunk_size` bytes, each
+    starting at an entry. A section without recognisable entries stays
+    whole.
+    """
+    bounds = [start]
+    pos = start + chunk_size
+    while pos < end:
+        m = entry_re.search(mm, pos, end)
+        if not m:
+            break
+        bounds.append(m.start())
+        pos = m.start() + chunk_size
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+
+def offer_chunks(filename, chunk_size=CHUNK_SIZE):
+    """
+    Returns (section, start, end) byte ranges covering every entry of the
+    sections in `filename`, in file order.
+    """
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            chunks = []
+            for name, start, end in sections(mm):
+                for bounds in chunk_bounds(mm, start, end, ENTRY_RES[name], chunk_size):
+                    chunks.append((name,) + bounds)
+            return chunks
+
+
+def read_chunk(filename, start, end):
+    with open(filename, "rb") as f:
+        f.seek(start)
+        return f.read(end - start).decode("utf-8")
+
+
+def entries(text):
+    """
+    Parses the `"key": value` pairs of a chunk, stopping at whatever closes
+    the section.
+    """
+    decoder = json.JSONDecoder()
+    found = {}
+    pos = 0
+    while m := KEY_RE.match(text, pos):
+        found[m.group(1)], pos = decoder.raw_decode(text, m.end())
+    return found
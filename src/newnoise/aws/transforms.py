@@ -1,4 +1,4 @@
-import json
+from .. import jsonio
 
 
 def get_single(d):
@@ -9,6 +9,13 @@ def get_single(d):
     return list(d.values())[0]
 
 
+def get_single_item(d):
+    """
+    same as `get_single`, but with the key
+    """
+    return list(d.items())[0]
+
+
 def flatten_prices(price, price_type="on_demand"):
     for _price_id, price_dim in price["priceDimensions"].items():
         price_id = price_dim["rateCode"]
@@ -40,37 +47,68 @@ def flatten_prices(price, price_type="on_demand"):
         yield {price_id: new_p}
 
 
-def price_csv_format(price):
+# Position of the currency in a `price_row`
+PRICE_ROW_CURRENCY = 7
+
+
+def price_row(flat_p):
+    """
+    Spreads a price from `flatten_prices` over the columns of the prices
+    table, from rateCode to termOfferingClass. Fields the price does not
+    have are None.
+    """
+    rate_code, p = get_single_item(flat_p)
+    currency = None
+    if "USD" in p:
+        currency = "USD"
+    elif "CNY" in p:
+        currency = "CNY"
+    return (
+        rate_code,
+        p["effectiveDateStart"],
+        p["purchaseOption"],
+        p["unit"],
+        p["description"],
+        p.get("startUsageAmount"),
+        p.get("endUsageAmount"),
+        currency,
+        p.get(currency),
+        p.get("termLength"),
+        p.get("termPurchaseOption"),
+        p.get("termOfferingClass"),
+    )
+
+
+def price_from_row(row):
+    """
+    Rebuilds the price `flatten_prices` made from the prices table columns
+    effectiveDateStart to termOfferingClass, with its keys in the same order
+    """
+    (start, option, unit, description, begin, end, currency, amount) = row[:8]
+    (term_length, term_option, term_class) = row[8:]
+    p = {
+        "effectiveDateStart": start,
+        "purchaseOption": option,
+        "unit": unit,
+        "description": description,
+    }
+    if begin is not None:
+        p["startUsageAmount"] = begin
+    if end is not None:
+        p["endUsageAmount"] = end
+    if currency is not None:
+        p[currency] = amount
+    if term_length is not None:
+        p["termLength"] = term_length
+    if term_option is not None:
+        p["termPurchaseOption"] = term_option
+    if term_class is not None:
+        p["termOfferingClass"] = term_class
+    return p
+
+
+def price_csv_format(prices):
     """
     restructure prices to match expected csv format
     """
-    loaded_prices = json.loads(price)
-    new_prices = []
-    for lp in loaded_prices:
-        lp = json.loads(lp)
-        lp = get_single(lp)
-        new_prices.append(lp)
-    return json.dumps({"aoc_for_prez_2028": new_prices})
-
-
-def find_start_tier(price_dims):
-    for k, v in price_dims.items():
-        if "startUsageAmount" in v and v["startUsageAmount"] == "0":
-            return k
-    else:
-        print("NO START TIER:", price_dims)
-        return None
-
-
-def merge_start_tier(sku_prices, new_start_tier):
-    new_id, new_dim = list(new_start_tier.items())[0]
-
-    price_dims = sku_prices[0]
-    lowest_id = find_start_tier(price_dims)
-    if lowest_id:
-        # replace lowest tier's begin range with free tier's end range
-        lowest_dim = price_dims.pop(lowest_id)
-        lowest_dim["startUsageAmount"] = new_dim["endUsageAmount"]
-        price_dims[lowest_id] = lowest_dim
-        # save copy of free tier
-        price_dims[new_id] = new_dim
+    return jsonio.dumps({"aoc_for_prez_2028": prices})
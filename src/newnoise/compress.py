@@ -0,0 +1,117 @@
+import contextlib
+import gzip
+import lzma
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File suffix for each supported compression
+SUFFIXES = {
+    "gzip": ".gz",
+    "xz": ".xz",
+    "zstd": ".zst",
+}
+
+# Levels that favor keeping up with the network over the smallest file
+GZIP_LEVEL = 6
+XZ_PRESET = 1
+ZSTD_LEVEL = 3
+
+
+def available():
+    """
+    Returns the compressions usable with the installed packages. zstd needs
+    the optional `zstandard` package.
+    """
+    return [c for c in SUFFIXES if c != "zstd" or zstandard is not None]
+
+
+def compression_of(path):
+    for compression, suffix in SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def path_for(path, compression=None):
+    if compression:
+        return path + SUFFIXES[compression]
+    return path
+
+
+def variants(path):
+    """
+    Every name a file could be stored under, uncompressed first.
+    """
+    return [path] + [path + suffix for suffix in SUFFIXES.values()]
+
+
+def existing(path):
+    """
+    Returns the stored variant of `path` most recently written, or None if
+    there is none.
+    """
+    found = [p for p in variants(path) if os.path.exists(p)]
+    if not found:
+        return None
+    return max(found, key=os.path.getmtime)
+
+
+def base_path(path):
+    compression = compression_of(path)
+    if compression:
+        return path[: -len(SUFFIXES[compression])]
+    return path
+
+
+def remove_variants(stored_path):
+    """
+    Deletes the other variants of `stored_path`, eg. the gzip copy left
+    behind when a fetch switches to zstd.
+    """
+    for p in variants(base_path(stored_path)):
+        if p != stored_path and os.path.exists(p):
+            os.remove(p)
+
+
+def writer(fileobj, compression=None):
+    """
+    Wraps a binary file opened for writing so data written to the wrapper
+    is compressed on its way to `fileobj`. Closing the wrapper finishes the
+    compressed stream but leaves `fileobj` open.
+    """
+    if compression is None:
+        return contextlib.nullcontext(fileobj)
+    if compression == "gzip":
+        # mtime=0 keeps identical input producing identical output
+        return gzip.GzipFile(
+            fileobj=fileobj, mode="wb", compresslevel=GZIP_LEVEL, mtime=0
+        )
+    if compression == "xz":
+        return lzma.LZMAFile(fileobj, "wb", preset=XZ_PRESET)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return compressor.stream_writer(fileobj, closefd=False)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def open_read(path):
+    """
+    Opens `path` for binary reading, decompressing it on the fly according
+    to its suffix.
+    """
+    compression = compression_of(path)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "xz":
+        return lzma.open(path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError(f"Reading {path} needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    return open(path, "rb")
@@ -1,40 +1,751 @@
 import asyncio
+import collections
+import contextlib
+import heapq
+import io
+import json
 import os
+import queue
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import aiohttp
 
+from . import compress, jsonio
 
-async def fetch_file(session, url, dst_file, semaphore):
+MiB = 1024 * 1024
+
+# Bytes collected from the socket before a write to disk is queued
+CHUNK_SIZE = 4 * MiB
+
+# Chunks allowed to wait for the writer thread before a download pauses
+WRITE_QUEUE_DEPTH = 8
+
+# Size of aiohttp's socket read buffer
+READ_BUFSIZE = 1 * MiB
+
+# Statuses that mean try again later rather than give up
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Seconds of transfers the scheduler measures before adjusting concurrency
+RATE_WINDOW = 2.0
+
+# Upper bound for the jittered exponential backoff, in seconds
+MAX_BACKOFF = 60.0
+
+# Chunks a `Pipe` holds for its reader before the download pauses
+PIPE_DEPTH = 16
+
+
+class DownloadError(Exception):
+    """
+    Raised when the server answers with a status other than the content.
+    """
+
+    def __init__(self, url, status, retry_after=None):
+        super().__init__(f"Failed to download {url}. Status code: {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status in RETRY_STATUSES
+
+
+class ChunkWriter:
+    """
+    Writes chunks to an open file from a dedicated thread so a slow disk
+    never stalls the event loop, and with it every other transfer. At most
+    `depth` chunks are queued; beyond that `write` waits for the disk.
+    """
+
+    def __init__(self, f, depth=WRITE_QUEUE_DEPTH):
+        self.f = f
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = collections.deque()
+
+    async def write(self, chunk):
+        while len(self.pending) >= self.depth:
+            await self.pending.popleft()
+        loop = asyncio.get_running_loop()
+        self.pending.append(loop.run_in_executor(self.executor, self.f.write, chunk))
+
+    async def flush(self):
+        while self.pending:
+            await self.pending.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        try:
+            await self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+class Pipe(io.RawIOBase):
+    """
+    Carries a response body to a blocking reader, eg. a parser running in
+    another thread, without going through a file. `write` blocks once
+    `depth` chunks wait to be read, so a slow reader slows the download
+    instead of filling memory. An error passed to `finish` is raised in the
+    reader.
+
+    Written chunks are also written to `tee`, if given. `nread` counts the
+    bytes read so far.
+    """
+
+    def __init__(self, depth=PIPE_DEPTH, tee=None):
+        self.chunks = queue.Queue(depth)
+        self.tee = tee
+        self.chunk = memoryview(b"")
+        self.pos = 0
+        self.nread = 0
+        self.eof = False
+        self.abandoned = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.pos >= len(self.chunk):
+            if self.eof:
+                return 0
+            item = self.chunks.get()
+            if item is None:
+                self.eof = True
+                return 0
+            if isinstance(item, BaseException):
+                self.eof = True
+                raise item
+            self.chunk = memoryview(item)
+            self.pos = 0
+        n = min(len(buffer), len(self.chunk) - self.pos)
+        buffer[:n] = self.chunk[self.pos : self.pos + n]
+        self.pos += n
+        self.nread += n
+        return n
+
+    def write(self, chunk):
+        if self.tee is not None:
+            self.tee.write(chunk)
+        self.put(chunk)
+        return len(chunk)
+
+    def put(self, item):
+        while not self.abandoned:
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+        raise BrokenPipeError("reader stopped reading")
+
+    def finish(self, error=None):
+        """
+        Ends the body, cleanly or with `error`.
+        """
+        try:
+            self.put(error)
+        except BrokenPipeError:
+            pass
+
+    def abandon(self):
+        """
+        Called by the reader when it stops early, so the writer does not
+        wait on it forever.
+        """
+        self.abandoned = True
+
+
+def load_manifest(path):
+    """
+    Reads the fetch manifest at `path`. The manifest maps each destination
+    path to what was known about it after its last successful download: the
+    URL, ETag, Last-Modified, size on disk and length as sent. Unfinished
+    `.part` files are listed with the validator needed to resume them. A
+    missing manifest is an empty one.
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def conditional_headers(entry, url, dst_file):
+    """
+    Builds the headers for a conditional GET when the manifest `entry` still
+    describes the file on disk and the URL has not moved.
+    """
+    headers = {}
+    if not entry or entry.get("url") != url:
+        return headers
+    if not os.path.exists(dst_file) or os.path.getsize(dst_file) != entry.get("size"):
+        return headers
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+class Scheduler:
+    """
+    Hands out download slots. The number of slots starts at `initial` and
+    grows by one, up to `maximum`, each time aggregate throughput over a
+    `RATE_WINDOW` improves while transfers are waiting. Errors and throttling
+    responses halve it. Slots are granted in request order.
+
+    When `max_bandwidth` (bytes per second) is set, transfers are paused
+    as needed to keep the combined rate under it.
+    """
+
+    def __init__(self, maximum, initial=2, max_bandwidth=None):
+        self.maximum = maximum
+        self.limit = max(1, min(initial, maximum))
+        # the most slots handed out at once so far
+        self.peak = self.limit
+        self.active = 0
+        self.waiters = collections.deque()
+
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.last_rate = 0.0
+
+        self.max_bandwidth = max_bandwidth
+        self.tokens = max_bandwidth or 0
+        self.tokens_at = time.monotonic()
+
+    async def __aenter__(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return self
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.active < self.limit:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    def throttled(self):
+        limit = max(1, self.limit // 2)
+        if limit != self.limit:
+            print(f"scheduler :: backing off to {limit} concurrent downloads")
+        self.limit = limit
+        self.last_rate = 0.0
+
+    async def transferred(self, nbytes):
+        now = time.monotonic()
+
+        self.window_bytes += nbytes
+        elapsed = now - self.window_start
+        if elapsed >= RATE_WINDOW:
+            rate = self.window_bytes / elapsed
+            if rate > self.last_rate * 1.05 and self.waiters:
+                if self.limit < self.maximum:
+                    self.limit += 1
+                    self.peak = max(self.peak, self.limit)
+                    self.wake()
+            self.last_rate = rate
+            self.window_start = now
+            self.window_bytes = 0
+
+        if self.max_bandwidth:
+            # token bucket holding at most one second worth of transfer
+            self.tokens += (now - self.tokens_at) * self.max_bandwidth
+            self.tokens = min(self.tokens, self.max_bandwidth) - nbytes
+            self.tokens_at = now
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.max_bandwidth)
+
+
+def backoff(attempt, retry_after=None):
+    """
+    Seconds to wait before retry number `attempt`. A Retry-After from the
+    server wins, otherwise it is full jitter exponential backoff.
+    """
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(MAX_BACKOFF, 2**attempt))
+
+
+def retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def throughput(nbytes, seconds):
+    rate = nbytes / MiB / seconds if seconds > 0 else 0
+    return f"{nbytes / MiB:.1f} MiB in {seconds:.1f}s ({rate:.1f} MiB/s)"
+
+
+def part_validator(response):
+    """
+    Returns the value for an If-Range header that only lets a resumed
+    download continue if the file has not changed since it was started.
+    """
+    return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+
+async def stream_to_file(response, f, chunk_size, transfer, scheduler):
+    """
+    Copies a response body into `f` through a `ChunkWriter`, coalescing
+    socket reads into `chunk_size` writes. Bytes received are counted in
+    `transfer`, even if the body is cut short, and reported to `scheduler`.
+    """
+    buf = bytearray()
+    async with ChunkWriter(f) as writer:
+        try:
+            async for data in response.content.iter_any():
+                buf += data
+                transfer["bytes"] += len(data)
+                await scheduler.transferred(len(data))
+                if len(buf) >= chunk_size:
+                    await writer.write(bytes(buf))
+                    buf.clear()
+        finally:
+            # keep what did arrive so a resumed attempt does not ask for it
+            if buf:
+                await writer.write(bytes(buf))
+
+
+async def fetch_part(
+    session, url, dst_file, headers, manifest, chunk_size, transfer, scheduler
+):
+    """
+    Makes one attempt at downloading `url` into `dst_file`.part, continuing
+    from whatever an earlier attempt left there. The part file only replaces
+    `dst_file` once the bytes received match what the server said they
+    would be.
+
+    A `dst_file` with a compression suffix, eg. `.gz`, is compressed while
+    it is written. Compressed part files cannot be resumed, so those start
+    over after a failure.
+    """
+    part_file = f"{dst_file}.part"
+    part = manifest.get(part_file)
+    compression = compress.compression_of(dst_file)
+
+    offset = 0
+    headers = dict(headers)
+    if part and part.get("url") == url and part.get("validator") and not compression:
+        offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = part["validator"]
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 304:
+            print(f"{dst_file} :: unchanged")
+            manifest.pop(part_file, None)
+            if os.path.exists(part_file):
+                os.remove(part_file)
+            return
+        elif response.status == 206:
+            content_range = response.headers.get("Content-Range", "")
+            if not content_range.startswith(f"bytes {offset}-"):
+                manifest.pop(part_file, None)
+                raise aiohttp.ClientPayloadError(
+                    f"Unexpected range {content_range!r} for {url}"
+                )
+            mode = "ab"
+        elif response.status == 200:
+            # server sent the whole file, either as asked or because it changed
+            offset = 0
+            mode = "wb"
+        elif response.status == 416:
+            # part file is no use to the server, start over next attempt
+            manifest.pop(part_file, None)
+            os.remove(part_file)
+            raise aiohttp.ClientPayloadError(f"Range not satisfiable for {url}")
+        else:
+            raise DownloadError(url, response.status, retry_after(response))
+
+        expected = None
+        if response.content_length is not None:
+            expected = offset + response.content_length
+        if not compression:
+            manifest[part_file] = {"url": url, "validator": part_validator(response)}
+
+        before = transfer["bytes"]
+        with open(part_file, mode) as raw:
+            with compress.writer(raw, compression) as f:
+                await stream_to_file(response, f, chunk_size, transfer, scheduler)
+
+        length = offset + transfer["bytes"] - before
+        if expected is not None and length != expected:
+            raise aiohttp.ClientPayloadError(
+                f"Incomplete download of {url}: {length} of {expected} bytes"
+            )
+
+        os.replace(part_file, dst_file)
+        manifest.pop(part_file, None)
+        manifest[dst_file] = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "size": os.path.getsize(dst_file),
+            "length": length,
+        }
+
+
+async def stream_part(session, url, pipe, state, chunk_size, transfer, scheduler):
+    """
+    Makes one attempt at sending the body of `url` into `pipe`. An attempt
+    after a dropped connection asks for the rest of the body with a Range
+    request, as what arrived already went to the reader. The validator
+    that lets it do so is kept in `state`.
+    """
+    offset = transfer["bytes"]
+    validator = state.get("validator")
+    headers = {}
+    if offset:
+        if not validator:
+            raise RuntimeError(f"{url} dropped and cannot be resumed")
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 206 and offset:
+            content_range = response.headers.get("Content-Range", "")
+            if not content_range.startswith(f"bytes {offset}-"):
+                raise aiohttp.ClientPayloadError(
+                    f"Unexpected range {content_range!r} for {url}"
+                )
+        elif response.status == 200 and offset:
+            raise RuntimeError(f"{url} changed while it was streamed")
+        elif response.status == 200:
+            state["validator"] = part_validator(response)
+        else:
+            raise DownloadError(url, response.status, retry_after(response))
+
+        expected = None
+        if response.content_length is not None:
+            expected = offset + response.content_length
+        await stream_to_file(response, pipe, chunk_size, transfer, scheduler)
+        if expected is not None and transfer["bytes"] != expected:
+            raise aiohttp.ClientPayloadError(
+                f"Incomplete download of {url}: {transfer['bytes']} of {expected} bytes"
+            )
+
+
+async def stream_file(
+    session, url, pipe, scheduler, retries=5, chunk_size=CHUNK_SIZE, transfer=None
+):
+    """
+    Downloads `url` into `pipe` with the retries and scheduling of
+    `fetch_file`, then ends the pipe. A failure ends the pipe with the
+    error before it is raised here.
+    """
+    if transfer is None:
+        transfer = new_transfer(url, url)
+    state = {}
+
+    async def attempt():
+        await stream_part(session, url, pipe, state, chunk_size, transfer, scheduler)
+
+    try:
+        await retrying(attempt, transfer["path"], scheduler, retries, transfer)
+    except BaseException as e:
+        pipe.finish(e)
+        raise
+    pipe.finish()
+    return transfer
+
+
+def new_transfer(url, dst_file):
+    return {
+        "url": url,
+        "path": dst_file,
+        "ok": False,
+        "bytes": 0,
+        "attempts": 0,
+        "seconds": 0.0,
+        "error": None,
+    }
+
+
+async def fetch_file(
+    session,
+    url,
+    dst_file,
+    scheduler,
+    manifest=None,
+    retries=5,
+    chunk_size=CHUNK_SIZE,
+    transfer=None,
+):
     """
     Downloads a single file from a URL to a specified destination path.
 
     This coroutine:
-    - Uses a semaphore to limit the number of concurrent downloads.
-    - Sends a HEAD request to the URL to pre-check resource.
-    - Downloads the file in chunks and writes it to disk.
-    - Prints a success message upon completion or raises an exception on failure.
+    - Uses a scheduler to limit the number of concurrent downloads.
+    - Sends a conditional GET when the manifest says the file on disk is
+      current, and leaves the file alone if the server answers 304.
+    - Downloads the file to `dst_file`.part, writing `chunk_size` chunks from
+      a writer thread, and renames it into place once the length matches the
+      Content-Length. A compression suffix on `dst_file` compresses it on
+      the way to disk.
+    - Retries dropped connections, timeouts and 429/5xx responses up to
+      `retries` times with jittered exponential backoff, giving up its slot
+      while it waits. Dropped transfers resume with a Range request. A part
+      file left by an earlier run is resumed too if the manifest recorded
+      its ETag or Last-Modified.
+    - Records the URL, ETag, Last-Modified and size in the manifest.
+    - Prints the file's throughput upon completion or raises an exception
+      on failure.
 
     Parameters:
     - session (aiohttp.ClientSession): The session used for HTTP requests.
     - url (str): The full URL of the file to download.
     - dst_file (str): The full path where the file should be saved.
-    - semaphore (asyncio.Semaphore): Semaphore used to control concurrency.
+    - scheduler (Scheduler): Scheduler used to control concurrency.
+    - manifest (dict): Optional fetch manifest, updated in place.
+    - retries (int): Number of times a failed transfer is retried (default is 5).
+    - chunk_size (int): Bytes per write to disk (default is `CHUNK_SIZE`).
+    - transfer (dict): Optional record of the transfer, updated in place.
+
+    Returns the transfer record.
+    """
+    if manifest is None:
+        manifest = {}
+    if transfer is None:
+        transfer = new_transfer(url, dst_file)
+    headers = conditional_headers(manifest.get(dst_file), url, dst_file)
+
+    def attempt():
+        return fetch_part(
+            session, url, dst_file, headers, manifest, chunk_size, transfer, scheduler
+        )
+
+    await retrying(attempt, dst_file, scheduler, retries, transfer)
+    return transfer
+
+
+async def retrying(attempt, name, scheduler, retries, transfer):
+    """
+    Awaits `attempt()` in a scheduler slot until it succeeds, retrying
+    dropped connections, timeouts and 429/5xx responses up to `retries`
+    times. Marks the transfer ok and prints its throughput when done.
+    """
+    for n in range(retries + 1):
+        transfer["attempts"] += 1
+        try:
+            async with scheduler:
+                start = time.monotonic()
+                try:
+                    await attempt()
+                finally:
+                    transfer["seconds"] += time.monotonic() - start
+            break
+        except DownloadError as e:
+            if not e.retryable or n == retries:
+                raise
+            scheduler.throttled()
+            reason = f"status {e.status}"
+            delay = backoff(n, e.retry_after)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if n == retries:
+                raise
+            scheduler.throttled()
+            reason = type(e).__name__
+            delay = backoff(n)
+        print(f"{name} :: retrying in {delay:.1f}s after {reason}")
+        await asyncio.sleep(delay)
+
+    transfer["ok"] = True
+    if transfer["bytes"]:
+        print(f"{name} :: {throughput(transfer['bytes'], transfer['seconds'])}")
+
+
+async def report_file(session, url, dst_file, scheduler, manifest, **kw):
+    """
+    Runs `fetch_file` and turns a failure into the transfer's error instead
+    of letting it abort the other downloads.
+    """
+    transfer = new_transfer(url, dst_file)
+    try:
+        await fetch_file(
+            session, url, dst_file, scheduler, manifest, transfer=transfer, **kw
+        )
+    except Exception as e:
+        transfer["error"] = f"{type(e).__name__}: {e}"
+        print(f"{dst_file} :: FAILED {transfer['error']}")
+    return transfer
+
+
+async def report_stream(
+    session, url, path, consume, scheduler, executor, tee=False, **kw
+):
+    """
+    Streams `url` into `consume(pipe, path)`, which runs on `executor`
+    while the body downloads. With `tee` the body is also written to
+    `path`. Like `report_file`, failures end up in the transfer record.
+    """
+    transfer = new_transfer(url, path)
+    loop = asyncio.get_running_loop()
+    part_file = f"{path}.part"
+    try:
+        with contextlib.ExitStack() as stack:
+            f = None
+            if tee:
+                raw = stack.enter_context(open(part_file, "wb"))
+                f = stack.enter_context(
+                    compress.writer(raw, compress.compression_of(path))
+                )
+            pipe = Pipe(tee=f)
+            consumer = loop.run_in_executor(executor, consume, pipe, path)
+            try:
+                await stream_file(
+                    session, url, pipe, scheduler, transfer=transfer, **kw
+                )
+            finally:
+                await consumer
+        if tee:
+            os.replace(part_file, path)
+    except Exception as e:
+        transfer["ok"] = False
+        transfer["error"] = f"{type(e).__name__}: {e}"
+        print(f"{path} :: FAILED {transfer['error']}")
+        if os.path.exists(part_file):
+            os.remove(part_file)
+    return transfer
+
+
+def print_report(report):
+    failed = [t for t in report if not t["ok"]]
+    print(f"fetched :: {len(report) - len(failed)} ok, {len(failed)} failed")
+    for t in failed:
+        print(f"  {t['path']} after {t['attempts']} attempts :: {t['error']}")
+
+
+async def probe_size(session, url, semaphore):
+    """
+    Asks the server for the size of `url` without downloading it. Returns
+    None if the server will not say.
     """
     async with semaphore:
-        async with session.head(url) as response:
-            async with session.get(url) as response:
+        try:
+            async with session.head(url) as response:
                 if response.status == 200:
-                    # 1KB chunks
-                    with open(dst_file, "wb") as f:
-                        async for chunk in response.content.iter_chunked(1024):
-                            f.write(chunk)
-                else:
-                    raise Exception(
-                        f"Failed to download {url}. Status code: {response.status}"
-                    )
+                    return response.content_length
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+    return None
+
+
+async def estimate_sizes(session, filepairs, manifest, max_concurrent, probe=True):
+    """
+    Returns the expected size of each file. Sizes come from the manifest of
+    the previous fetch where possible and from a HEAD request otherwise.
+    A single file has no order to plan, so it is never probed. Unknown
+    sizes are 0.
+    """
+    manifest = manifest or {}
+    sizes = []
+    for _, dst in filepairs:
+        entry = manifest.get(dst, {})
+        sizes.append(entry.get("length", entry.get("size")))
+    unknown = [i for i, size in enumerate(sizes) if size is None]
+    if probe and unknown and len(filepairs) > 1:
+        semaphore = asyncio.Semaphore(max_concurrent)
+        probed = await asyncio.gather(
+            *[probe_size(session, filepairs[i][0], semaphore) for i in unknown]
+        )
+        for i, size in zip(unknown, probed):
+            sizes[i] = size
+    return [size or 0 for size in sizes]
+
+
+def makespan(sizes, slots):
+    """
+    Bytes handled by the busiest of `slots` when each file, in the given
+    order, starts on whichever slot frees up first.
+    """
+    loads = [0] * max(1, slots)
+    for size in sizes:
+        heapq.heappush(loads, heapq.heappop(loads) + size)
+    return max(loads)
+
+
+def print_plan(sizes, order, slots, report, elapsed):
+    """
+    Compares the makespan planned for largest first scheduling with request
+    order and with what actually happened. Planned times assume `slots`
+    concurrent downloads from the start, each at the average per-download
+    rate seen in this fetch. The scheduler only ramps up to its peak, so
+    they are a lower bound. Without any known sizes there was nothing to
+    plan, and nothing printed.
+    """
+    received = sum(t["bytes"] for t in report)
+    busy = sum(t["seconds"] for t in report)
+    if not received or not busy or not any(sizes):
+        return
+    rate = received / busy
+    planned = makespan([sizes[i] for i in order], slots) / rate
+    requested = makespan(sizes, slots) / rate
+    print(
+        f"makespan :: planned {planned:.1f}s largest first "
+        f"({requested:.1f}s in request order) on {slots} slots from the start, "
+        f"actual {elapsed:.1f}s"
+    )
 
 
-async def fetch_filepairs(filepairs, max_concurrent=5):
+def mk_session(max_concurrent):
+    """
+    Creates the session shared by every transfer of a fetch. The connection
+    pool is sized to the concurrency limit and kept warm between files, and
+    there is no overall timeout since the largest offer files take a while.
+
+    Bodies are asked for without content coding, so Content-Length, Range
+    offsets and the bytes counted on arrival all measure the same thing.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrent,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        read_bufsize=READ_BUFSIZE,
+        headers={"Accept-Encoding": "identity"},
+    )
+
+
+async def fetch_filepairs(
+    filepairs,
+    max_concurrent=8,
+    manifest_path=None,
+    chunk_size=CHUNK_SIZE,
+    retries=5,
+    max_bandwidth=None,
+    probe=True,
+):
     """
     Downloads multiple files concurrently with a concurrency limit.
 
@@ -42,23 +753,130 @@ async def fetch_filepairs(filepairs, max_concurrent=5):
     - Accepts a list of (URL, destination path) pairs.
     - Ensures the directory structure for each destination file exists.
     - Constructs the full URL using an environment-specific API prefix.
-    - Uses a semaphore to limit the number of concurrent downloads.
+    - Uses a `Scheduler` to adapt the number of concurrent downloads, up to
+      `max_concurrent`, to throughput and errors. The downloads share one
+      connection pool.
+    - Starts the largest files first, so a giant file is not left to run
+      alone at the end. Sizes come from the manifest, or when `probe` is
+      set, a HEAD request for files it does not know.
+    - Skips files the manifest at `manifest_path` shows to be unchanged and
+      saves the updated manifest afterwards, even if a download failed.
+    - Keeps going when a file fails, and prints a report of every failure
+      along with the aggregate throughput of the whole batch.
 
     Parameters:
     - filepairs (List[Tuple[str, str]]): List of (relative URL, local path) pairs to download.
-    - max_concurrent (int): Maximum number of concurrent downloads (default is 5).
-    """
-    semaphore = asyncio.Semaphore(max_concurrent)
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for url, dst_path in filepairs:
-            # prepare service specific directories
-            dst_parents = os.path.dirname(dst_path)
-            if dst_parents:
-                os.makedirs(dst_parents, exist_ok=True)
-
-            # coroutine for each URL
-            tasks.append(fetch_file(session, url, dst_path, semaphore))
-
-        # make fetch happen
-        await asyncio.gather(*tasks)
+    - max_concurrent (int): Maximum number of concurrent downloads (default is 8).
+    - manifest_path (str): Path of the fetch manifest (default is no manifest).
+    - chunk_size (int): Bytes per write to disk (default is `CHUNK_SIZE`).
+    - retries (int): Number of times a failed transfer is retried (default is 5).
+    - max_bandwidth (int): Bytes per second for all transfers (default is no cap).
+    - probe (bool): Ask the server for sizes the manifest lacks (default is True).
+
+    Returns a list of transfer records, one per file.
+    """
+    manifest = load_manifest(manifest_path) if manifest_path else None
+    scheduler = Scheduler(max_concurrent, max_bandwidth=max_bandwidth)
+    filepairs = list(filepairs)
+    try:
+        async with mk_session(max_concurrent) as session:
+            # longest processing time first
+            sizes = await estimate_sizes(
+                session, filepairs, manifest, max_concurrent, probe
+            )
+            order = sorted(range(len(filepairs)), key=lambda i: -sizes[i])
+
+            start = time.monotonic()
+            tasks = []
+            for url, dst_path in [filepairs[i] for i in order]:
+                # prepare service specific directories
+                dst_parents = os.path.dirname(dst_path)
+                if dst_parents:
+                    os.makedirs(dst_parents, exist_ok=True)
+
+                # coroutine for each URL
+                tasks.append(
+                    report_file(
+                        session,
+                        url,
+                        dst_path,
+                        scheduler,
+                        manifest,
+                        retries=retries,
+                        chunk_size=chunk_size,
+                    )
+                )
+
+            # make fetch happen
+            report = await asyncio.gather(*tasks)
+            if len(tasks) > 1:
+                elapsed = time.monotonic() - start
+                received = sum(t["bytes"] for t in report)
+                print(f"total :: {throughput(received, elapsed)}")
+                print_plan(sizes, order, scheduler.peak, report, elapsed)
+                print_report(report)
+            return report
+    finally:
+        if manifest is not None:
+            jsonio.save(manifest_path, manifest)
+
+
+async def stream_filepairs(
+    filepairs,
+    consume,
+    max_concurrent=8,
+    chunk_size=CHUNK_SIZE,
+    retries=5,
+    max_bandwidth=None,
+    tee=False,
+):
+    """
+    Hands the body of each URL to a consumer as it downloads, instead of
+    writing it to disk first.
+
+    This coroutine:
+    - Accepts a list of (URL, destination path) pairs, like
+      `fetch_filepairs`, and downloads them under the same adaptive
+      `Scheduler`.
+    - Calls `consume(pipe, path)` in its own thread for each file. The
+      consumer reads the body from `pipe` as it arrives.
+    - With `tee`, also writes each body to its destination path, compressed
+      according to its suffix.
+    - Keeps going when a file fails, whether in the download or in the
+      consumer, and prints a report of every failure.
+
+    Returns a list of transfer records, one per file.
+    """
+    filepairs = list(filepairs)
+    scheduler = Scheduler(max_concurrent, max_bandwidth=max_bandwidth)
+    # one thread per file, a consumer blocked on a download that is waiting
+    # for a slot must not keep another file's consumer from starting
+    executor = ThreadPoolExecutor(max_workers=max(1, len(filepairs)))
+    try:
+        async with mk_session(max_concurrent) as session:
+            start = time.monotonic()
+            tasks = []
+            for url, dst_path in filepairs:
+                if tee and os.path.dirname(dst_path):
+                    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                tasks.append(
+                    report_stream(
+                        session,
+                        url,
+                        dst_path,
+                        consume,
+                        scheduler,
+                        executor,
+                        tee=tee,
+                        retries=retries,
+                        chunk_size=chunk_size,
+                    )
+                )
+            report = await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - start
+            received = sum(t["bytes"] for t in report)
+            print(f"total :: {throughput(received, elapsed)}")
+            print_report(report)
+            return report
+    finally:
+        executor.shutdown(wait=True)
@@ -0,0 +1,131 @@
+import json
+import os
+
+import json_stream
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Streaming parsers for offer files, json_stream is always installed
+BACKENDS = ["json_stream", "ijson"]
+DEFAULT_BACKEND = "json_stream"
+
+
+def streams(path):
+    """
+    Whether the object at `path`, a tuple of keys, streams. These are the
+    offer file itself, its sections and the kinds of terms, the entries in
+    them are built whole.
+    """
+    return len(path) < 2 or (len(path) == 2 and path[0] == "terms")
+
+
+def available():
+    """
+    Returns the backends usable with the installed packages. ijson needs the
+    optional `ijson` package, ideally with its yajl2 C library.
+    """
+    return [b for b in BACKENDS if b != "ijson" or ijson is not None]
+
+
+class IjsonObject:
+    """
+    An object read from ijson events as it is iterated, standing in for the
+    transient objects of json_stream. Objects `streams` picks stream too,
+    other values are built whole. Entries left unread are skipped when the
+    parent moves on.
+    """
+
+    def __init__(self, events, path=()):
+        self.events = events
+        self.path = path
+        self.done = False
+
+    def items(self):
+        for _, event, key in self.events:
+            if event == "end_map":
+                self.done = True
+                return
+            _, event, value = next(self.events)
+            if event == "start_map" and streams(self.path + (key,)):
+                child = IjsonObject(self.events, self.path + (key,))
+                yield key, child
+                child.skip()
+            elif event in ("start_map", "start_array"):
+                yield key, self.build(event, value)
+            else:
+                yield key, value
+
+    def build(self, event, value):
+        builder = ijson.ObjectBuilder()
+        builder.event(event, value)
+        nesting = 1
+        for _, event, value in self.events:
+            builder.event(event, value)
+            if event in ("start_map", "start_array"):
+                nesting += 1
+            elif event in ("end_map", "end_array"):
+                nesting -= 1
+                if nesting == 0:
+                    return builder.value
+
+    def skip(self):
+        if not self.done:
+            for _ in self.items():
+                pass
+
+
+def load(fileobj, backend=DEFAULT_BACKEND):
+    """
+    Starts streaming the JSON object in `fileobj`. The result, and the
+    objects in it down to the sections of an offer file, are read as
+    `.items()` is iterated.
+    """
+    if backend == "json_stream":
+        return json_stream.load(fileobj)
+    if backend == "ijson":
+        if ijson is None:
+            raise ValueError("The ijson backend needs the ijson package")
+        events = iter(ijson.parse(fileobj, use_float=True))
+        _, event, _ = next(events)
+        if event != "start_map":
+            raise ValueError("Expected a JSON object")
+        return IjsonObject(events)
+    raise ValueError(f"Unknown JSON backend: {backend}")
+
+
+def loads(s):
+    """
+    Parses a complete document, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+def save(path, obj):
+    """
+    Writes `obj` to `path` as indented JSON with sorted keys, for manifests
+    meant to be read and diffed by people too. The file is replaced
+    atomically so an interrupted run never leaves half of one.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def dumps(obj):
+    """
+    Serializes `obj` for the cache and CSV dumps. This stays with the
+    stdlib, orjson cannot write the spaced separators and ASCII escapes
+    that existing caches and dumps are made of.
+    """
+    return json.dumps(obj)
@@ -29,6 +29,19 @@ HANDLERS = [
 ]
 
 
+def servicecodes(handlers=HANDLERS):
+    """
+    Returns the set of AWS servicecodes consumed by `handlers`, or None if
+    any handler can match products from every service.
+    """
+    codes = set()
+    for h in handlers:
+        if h.SERVICECODE is None:
+            return None
+        codes.add(h.SERVICECODE)
+    return codes
+
+
 def sheet(args):
     input_file = args.input
     output_dir = args.output
@@ -1,8 +1,9 @@
 import os
 import csv
-import json
 import urllib.parse
 
+from .. import jsonio
+
 
 
 PRODUCTHASH = 0
@@ -76,8 +77,8 @@ def of_csv(input_file, handlers, ccy=None, **column_query):
                     break
             # match on attrs or price via handler
             else:
-                row[ATTRIBUTES] = json.loads(row[ATTRIBUTES])
-                row[PRICES] = json.loads(row[PRICES])
+                row[ATTRIBUTES] = jsonio.loads(row[ATTRIBUTES])
+                row[PRICES] = jsonio.loads(row[PRICES])
                 # can create match set
                 for h in handlers:
                     if h.match(row) and h.match_currency(row, ccy=ccy):
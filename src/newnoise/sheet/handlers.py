@@ -35,6 +35,8 @@ def process(
 class BaseHandler:
     SERVICE_PROVIDER = "overwrite with service provider"
     TF = "overwrite with name of TF resource"
+    # servicecode of the products a handler matches, None matches any service
+    SERVICECODE = None
 
     def __init__(self, **match_params):
         self.match_params = match_params
@@ -54,10 +56,12 @@ class AWSBaseHandler(BaseHandler):
 
 
 class BaseInstanceHandler(AWSBaseHandler):
+    SERVICECODE = "AmazonEC2"
+
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonEC2")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.required_attrs(row, ["instanceType"])
         )
 
@@ -113,13 +117,14 @@ class EC2HostHandler(BaseInstanceHandler):
 
 class LoadBalancerHandler(AWSBaseHandler):
     TF = "aws_lb"
+    SERVICECODE = "AWSELB"
 
     KEY_LBT = "load_balancer_type"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AWSELB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, v="LoadBalancerUsage")
             and matchers.price_purchaseoption(row, v="on_demand")
         )
@@ -209,10 +214,11 @@ class RDSBaseHandler(AWSBaseHandler):
 
 class RDSInstanceHandler(RDSBaseHandler):
     TF = "aws_db_instance"
+    SERVICECODE = "AmazonRDS"
 
     def match(self, row):
         return (
-            matchers.product_servicecode(row, v="AmazonRDS")
+            matchers.product_servicecode(row, v=self.SERVICECODE)
             and not matchers.product_attr(row, "databaseEdition", c="BYOM")
             and (
                 matchers.product_usagetype(row, v="InstanceUsage")
@@ -241,10 +247,11 @@ class RDSInstanceHandler(RDSBaseHandler):
 
 class RDSIOPSHandler(RDSBaseHandler):
     TF = "aws_db_instance"
+    SERVICECODE = "AmazonRDS"
 
     def match(self, row):
         return (
-            matchers.product_servicecode(row, v="AmazonRDS")
+            matchers.product_servicecode(row, v=self.SERVICECODE)
             and not matchers.product_attr(row, "databaseEdition", c="BYOM")
             and (
                 (
@@ -295,10 +302,11 @@ class RDSIOPSHandler(RDSBaseHandler):
 
 class RDSStorageHandler(RDSBaseHandler):
     TF = "aws_db_instance"
+    SERVICECODE = "AmazonRDS"
 
     def match(self, row):
         return (
-            matchers.product_servicecode(row, v="AmazonRDS")
+            matchers.product_servicecode(row, v=self.SERVICECODE)
             and not matchers.product_attr(row, "databaseEdition", c="BYOM")
             and not matchers.product_attr(row, "databaseEngine", v="Any")
             and (
@@ -351,9 +359,10 @@ class RDSStorageHandler(RDSBaseHandler):
 
 class S3OperationsHandler(AWSBaseHandler):
     TF = "aws_s3_bucket"
+    SERVICECODE = "AmazonS3"
 
     def match(self, row):
-        return matchers.product_servicecode(row, v="AmazonS3") and (
+        return matchers.product_servicecode(row, v=self.SERVICECODE) and (
             matchers.product_group(row, v="S3-API-Tier1")
             or matchers.product_group(row, v="S3-API-Tier2")
         )
@@ -382,10 +391,11 @@ class S3OperationsHandler(AWSBaseHandler):
 
 class S3StorageHandler(AWSBaseHandler):
     TF = "aws_s3_bucket"
+    SERVICECODE = "AmazonS3"
 
     def match(self, row):
         return matchers.product_servicecode(
-            row, v="AmazonS3"
+            row, v=self.SERVICECODE
         ) and matchers.product_usagetype(row, c="-TimedStorage-")
 
     def process(self, row):
@@ -405,11 +415,12 @@ class S3StorageHandler(AWSBaseHandler):
 
 class SQSFIFOHandler(AWSBaseHandler):
     TF = "aws_sqs_queue"
+    SERVICECODE = "AWSQueueService"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AWSQueueService")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="Requests")
             and matchers.product_usagetype(row, c="Requests-FIFO")
         )
@@ -430,11 +441,12 @@ class SQSFIFOHandler(AWSBaseHandler):
 
 class SQSHandler(AWSBaseHandler):
     TF = "aws_sqs_queue"
+    SERVICECODE = "AWSQueueService"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AWSQueueService")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="Requests")
             and not matchers.product_usagetype(row, c="Requests-FIFO")
         )
@@ -455,11 +467,12 @@ class SQSHandler(AWSBaseHandler):
 
 class LambdaHandler(AWSBaseHandler):
     TF = "aws_lambda_function"
+    SERVICECODE = "AWSLambda"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AWSLambda")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and (
                 matchers.product_usagetype(row, s="Lambda-GB-Second")
                 or matchers.product_usagetype(row, s="Lambda-GB-Second-ARM")
@@ -530,11 +543,12 @@ class LambdaHandler(AWSBaseHandler):
 
 class EBSStorageHandler(AWSBaseHandler):
     TF = "aws_ebs_volume"
+    SERVICECODE = "AmazonEC2"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonEC2")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="VolumeUsage")
         )
 
@@ -556,11 +570,12 @@ class EBSStorageHandler(AWSBaseHandler):
 
 class EBSIOPSHandler(AWSBaseHandler):
     TF = "aws_ebs_volume"
+    SERVICECODE = "AmazonEC2"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonEC2")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="IOPS")
             # io2 has special pricing tiers that we need to create in other handlers
             and not matchers.product_attr(row, "volumeApiName", v="io2")
@@ -602,11 +617,12 @@ class EBSIOPSHandler(AWSBaseHandler):
 
 class EBSIOPSIO2Tier1Handler(AWSBaseHandler):
     TF = "aws_ebs_volume"
+    SERVICECODE = "AmazonEC2"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonEC2")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="IOPS")
             # io2 has special pricing tiers that we need to create in other handlers
             and matchers.product_attr(row, "volumeApiName", v="io2")
@@ -633,11 +649,12 @@ class EBSIOPSIO2Tier1Handler(AWSBaseHandler):
 
 class EBSIOPSIO2Tier2Handler(AWSBaseHandler):
     TF = "aws_ebs_volume"
+    SERVICECODE = "AmazonEC2"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonEC2")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="IOPS")
             # io2 has special pricing tiers that we need to create in other handlers
             and matchers.product_attr(row, "volumeApiName", v="io2")
@@ -664,11 +681,12 @@ class EBSIOPSIO2Tier2Handler(AWSBaseHandler):
 
 class EBSIOPSIO2Tier3Handler(AWSBaseHandler):
     TF = "aws_ebs_volume"
+    SERVICECODE = "AmazonEC2"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonEC2")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="IOPS")
             # io2 has special pricing tiers that we need to create in other handlers
             and matchers.product_attr(row, "volumeApiName", v="io2")
@@ -695,11 +713,12 @@ class EBSIOPSIO2Tier3Handler(AWSBaseHandler):
 
 class DynamoDBStorageHandler(AWSBaseHandler):
     TF = "aws_dynamodb_table"
+    SERVICECODE = "AmazonDynamoDB"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonDynamoDB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="TimedStorage")
             and not matchers.product_usagetype(row, c="IA-TimedStorage")
         )
@@ -720,11 +739,12 @@ class DynamoDBStorageHandler(AWSBaseHandler):
 
 class DynamoDBStorageIAHandler(AWSBaseHandler):
     TF = "aws_dynamodb_table"
+    SERVICECODE = "AmazonDynamoDB"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonDynamoDB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="IA-TimedStorage")
         )
 
@@ -746,11 +766,12 @@ class DynamoDBStorageIAHandler(AWSBaseHandler):
 
 class DynamoDBRequestsHandler(AWSBaseHandler):
     TF = "aws_dynamodb_table"
+    SERVICECODE = "AmazonDynamoDB"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonDynamoDB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and (
                 (
                     matchers.product_usagetype(row, c="ReadRequestUnits")
@@ -793,11 +814,12 @@ class DynamoDBRequestsHandler(AWSBaseHandler):
 
 class DynamoDBRequestsIAHandler(AWSBaseHandler):
     TF = "aws_dynamodb_table"
+    SERVICECODE = "AmazonDynamoDB"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonDynamoDB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and (
                 matchers.product_usagetype(row, c="IA-ReadRequestUnits")
                 or matchers.product_usagetype(row, c="IA-WriteRequestUnits")
@@ -836,11 +858,12 @@ class DynamoDBRequestsIAHandler(AWSBaseHandler):
 
 class DynamoDBReplHandler(AWSBaseHandler):
     TF = "aws_dynamodb_table"
+    SERVICECODE = "AmazonDynamoDB"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonDynamoDB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="ReplWriteCapacity")
             and not matchers.product_usagetype(row, c="IA-ReplWriteCapacity")
         )
@@ -864,11 +887,12 @@ class DynamoDBReplHandler(AWSBaseHandler):
 
 class DynamoDBReplIAHandler(AWSBaseHandler):
     TF = "aws_dynamodb_table"
+    SERVICECODE = "AmazonDynamoDB"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonDynamoDB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="IA-ReplWriteCapacity")
         )
 
@@ -892,11 +916,12 @@ class DynamoDBReplIAHandler(AWSBaseHandler):
 
 class DynamoDBStreamsHandler(AWSBaseHandler):
     TF = "aws_dynamodb_table"
+    SERVICECODE = "AmazonDynamoDB"
 
     def match(self, row):
         return (
             super().match(row)
-            and matchers.product_servicecode(row, v="AmazonDynamoDB")
+            and matchers.product_servicecode(row, v=self.SERVICECODE)
             and matchers.product_usagetype(row, c="Streams-Requests")
         )
 
@@ -0,0 +1,179 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from . import compress, jsonio
+
+# Bytes read at a time while hashing
+HASH_BLOCK = 1024 * 1024
+
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def today():
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def snapshots_dir(root):
+    return os.path.join(root, "snapshots")
+
+
+def blobs_dir(root):
+    return os.path.join(root, "blobs")
+
+
+def snapshot_path(root, date):
+    return os.path.join(snapshots_dir(root), f"{date}.json")
+
+
+def blob_path(root, blob):
+    return os.path.join(blobs_dir(root), blob)
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK):
+            h.update(block)
+    return h.hexdigest()
+
+
+def blob_name(digest, path):
+    """
+    Names a blob by the hash of its bytes, keeping the extension of `path`
+    so readers still know how it is compressed.
+    """
+    base = compress.base_path(path)
+    ext = os.path.splitext(base)[1] + path[len(base) :]
+    return os.path.join(digest[:2], digest + ext)
+
+
+def link_or_copy(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp_path = f"{dst}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        # eg. filesystems without hardlinks
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def dates(root):
+    """
+    Dates with a snapshot, oldest first.
+    """
+    if not os.path.isdir(snapshots_dir(root)):
+        return []
+    found = []
+    for name in os.listdir(snapshots_dir(root)):
+        date, ext = os.path.splitext(name)
+        if ext == ".json" and DATE_RE.match(date):
+            found.append(date)
+    return sorted(found)
+
+
+def load(root, date):
+    """
+    Reads the snapshot taken on `date`. A snapshot maps each file, relative
+    to `root`, to the blob holding its contents on that day.
+    """
+    path = snapshot_path(root, date)
+    if not os.path.exists(path):
+        raise ValueError(f"No snapshot for {date}")
+    with open(path) as f:
+        return json.load(f)
+
+
+def take(root, paths, date=None):
+    """
+    Records the files at `paths` as the snapshot for `date`, today by
+    default. Replaces an earlier snapshot from the same day.
+
+    This function:
+    - hashes each file, unless it is still hardlinked to the blob the latest
+      snapshot recorded for it
+    - hardlinks files into the blob store, where identical files share one
+      blob across days
+    - writes the snapshot atomically
+    """
+    date = date or today()
+    previous = {}
+    if dates(root):
+        previous = load(root, dates(root)[-1])["files"]
+
+    files = {}
+    for path in paths:
+        rel = os.path.relpath(path, root)
+        entry = previous.get(rel)
+        if entry and os.path.exists(blob_path(root, entry["blob"])):
+            if os.path.samefile(path, blob_path(root, entry["blob"])):
+                files[rel] = entry
+                continue
+
+        digest = file_digest(path)
+        blob = blob_name(digest, path)
+        if not os.path.exists(blob_path(root, blob)):
+            link_or_copy(path, blob_path(root, blob))
+        files[rel] = {"blob": blob, "sha256": digest, "size": os.path.getsize(path)}
+
+    snapshot = {"date": date, "files": files}
+    os.makedirs(snapshots_dir(root), exist_ok=True)
+    jsonio.save(snapshot_path(root, date), snapshot)
+    return snapshot
+
+
+def checkout(root, date):
+    """
+    Lays the files of a snapshot out as hardlinks in a temporary directory
+    under `root`, in the same layout as `root` itself. The directory is
+    removed when the returned object is cleaned up.
+    """
+    snapshot = load(root, date)
+    tmp_dir = tempfile.TemporaryDirectory(prefix=f".snapshot-{date}-", dir=root)
+    for rel, entry in snapshot["files"].items():
+        link_or_copy(blob_path(root, entry["blob"]), os.path.join(tmp_dir.name, rel))
+    return tmp_dir
+
+
+def prune(root, keep):
+    """
+    Deletes all but the `keep` newest snapshots, then every blob no
+    remaining snapshot refers to. Returns the deleted dates and the bytes
+    freed.
+    """
+    all_dates = dates(root)
+    dropped = all_dates[: max(len(all_dates) - keep, 0)]
+    for date in dropped:
+        os.remove(snapshot_path(root, date))
+
+    used = set()
+    for date in dates(root):
+        used.update(e["blob"] for e in load(root, date)["files"].values())
+
+    freed = 0
+    for dirpath, _, filenames in os.walk(blobs_dir(root)):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.relpath(path, blobs_dir(root)) not in used:
+                freed += os.path.getsize(path)
+                os.remove(path)
+    return dropped, freed
+
+
+def usage(root):
+    """
+    Returns the bytes held by the blob store and the bytes the snapshots
+    would take as full copies.
+    """
+    stored = 0
+    for dirpath, _, filenames in os.walk(blobs_dir(root)):
+        stored += sum(os.path.getsize(os.path.join(dirpath, n)) for n in filenames)
+    logical = 0
+    for date in dates(root):
+        logical += sum(e["size"] for e in load(root, date)["files"].values())
+    return stored, logical
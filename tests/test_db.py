@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from newnoise import jsonio
+from newnoise.aws import db
+
+
+def test_hot_attributes_are_deduplicated(tmp_path):
+    db_name = str(tmp_path / "noises.db")
+    dbconn = db.mk_db(db_name, hot_attributes=["usagetype", "usagetype"])
+    assert db.hot_attributes(dbconn) == ["usagetype"]
+    dbconn.close()
+
+
+@pytest.mark.parametrize(
+    "names", [["Region"], ["SKU"], ["usageType", "usagetype"], ["a-b"]]
+)
+def test_colliding_hot_attributes_create_nothing(tmp_path, names):
+    db_name = str(tmp_path / "noises.db")
+    with pytest.raises(ValueError):
+        db.mk_db(db_name, hot_attributes=names)
+    assert not os.path.exists(db_name)
+
+
+@pytest.mark.parametrize(
+    "n, size",
+    [(0, 1), (127, 1), (128, 2), (300, 2), (16383, 2), (16384, 3), (2**35, 6)],
+)
+def test_varint_round_trip(n, size):
+    out = bytearray(b"x")
+    db.put_varint(out, n)
+    assert len(out) == 1 + size
+    assert db.get_varint(bytes(out) + b"y", 1) == (n, 1 + size)
+
+
+def test_attribute_codec_round_trip(tmp_path):
+    dbconn = db.mk_db(str(tmp_path / "noises.db"), compact_attributes=True)
+    products = [
+        {"location": "South America (São Paulo)", "note": "東京 🚀", "n": 3},
+        # enough keys for multi-byte key ids, and a value of multi-byte length
+        {f"key{i}": "x" * i for i in range(200)},
+        {},
+    ]
+    encode, decode = db.mk_attribute_codec(dbconn)
+    dbconn.execute("BEGIN")
+    blobs = [encode(db.attribute_pairs(attributes)) for attributes in products]
+    dbconn.commit()
+    assert all(blob[0] == db.COMPACT_VERSION for blob in blobs)
+    for attributes, blob in zip(products, blobs):
+        assert decode(blob) == jsonio.dumps(attributes)
+
+    # keys added since a codec was made are looked up when met
+    _, fresh_decode = db.mk_attribute_codec(dbconn)
+    encode(db.attribute_pairs({"added": "later"}))
+    assert fresh_decode(encode([("added", b'"later"')])) == '{"added": "later"}'
+    dbconn.close()
@@ -0,0 +1,296 @@
+import asyncio
+import contextlib
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from newnoise import download, jsonio
+
+BODY = bytes(range(256)) * 1200
+ETAG = '"v1"'
+REQUESTS = web.AppKey("requests", list)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download, "backoff", lambda attempt, retry_after=None: 0)
+
+
+def mk_app(body=BODY, etag=ETAG, drop=None, quirk=None):
+    """
+    Serves `body` at /f with Range and If-Range support. Each response is
+    cut after `drop` bytes if given. `quirk(request)` may answer a request
+    instead. Requests seen are kept in app[REQUESTS].
+    """
+    requests = []
+
+    async def handle(request):
+        requests.append(request.headers.copy())
+        if quirk is not None:
+            response = quirk(request)
+            if response is not None:
+                return response
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        start, status = 0, 200
+        ranged = request.headers.get("Range")
+        if ranged and request.headers.get("If-Range", etag) == etag:
+            start, status = int(ranged.split("=")[1].split("-")[0]), 206
+            if start >= len(body):
+                return web.Response(status=416)
+        headers = {"ETag": etag, "Content-Length": str(len(body) - start)}
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        end = len(body) if drop is None else min(len(body), start + drop)
+        for pos in range(start, end, 16384):
+            await response.write(body[pos : min(pos + 16384, end)])
+        if end < len(body):
+            request.transport.close()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/f", handle)
+    app[REQUESTS] = requests
+    return app
+
+
+@contextlib.asynccontextmanager
+async def serve(app):
+    async with TestServer(app) as server:
+        async with download.mk_session(2) as session:
+            yield session, str(server.make_url("/f"))
+
+
+async def fetch(session, url, dst_file, manifest, retries=5):
+    return await download.fetch_file(
+        session,
+        url,
+        dst_file,
+        download.Scheduler(2),
+        manifest,
+        retries=retries,
+        chunk_size=4096,
+    )
+
+
+def ranges(app):
+    return [headers.get("Range") for headers in app[REQUESTS]]
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_dropped_download_resumes(tmp_path):
+    dst_file = str(tmp_path / "f.json")
+    app = mk_app(drop=len(BODY) // 5 + 1)
+
+    async def main():
+        async with serve(app) as (session, url):
+            return await fetch(session, url, dst_file, {})
+
+    transfer = asyncio.run(main())
+    assert transfer["ok"] and transfer["attempts"] == 5
+    assert read(dst_file) == BODY
+    assert ranges(app)[0] is None
+    offsets = [int(r.split("=")[1].rstrip("-")) for r in ranges(app)[1:]]
+    assert offsets == sorted(offsets) and len(set(offsets)) == 4
+    assert all(h["If-Range"] == ETAG for h in app[REQUESTS][1:])
+
+
+def test_part_validator_saved_in_manifest(tmp_path):
+    dst_file = str(tmp_path / "f.json")
+    part_file = dst_file + ".part"
+    app = mk_app(drop=len(BODY) // 3)
+    manifest = {}
+
+    async def main():
+        async with serve(app) as (session, url):
+            with pytest.raises(aiohttp.ClientPayloadError):
+                await fetch(session, url, dst_file, manifest, retries=0)
+            assert manifest[part_file] == {"url": url, "validator": ETAG}
+            assert BODY.startswith(read(part_file))
+            # a later run picks the part file up where it was left
+            app[REQUESTS].clear()
+            await fetch(session, url, dst_file, manifest, retries=5)
+
+    asyncio.run(main())
+    assert read(dst_file) == BODY
+    assert not os.path.exists(part_file) and part_file not in manifest
+    assert ranges(app)[0] == f"bytes={len(BODY) // 3}-"
+
+
+def test_wrong_content_range_starts_over(tmp_path):
+    dst_file = str(tmp_path / "f.json")
+    answered = []
+
+    def quirk(request):
+        if request.headers.get("Range") and not answered:
+            answered.append(request)
+            # the whole body, labelled as a range from the start
+            return web.Response(
+                status=206,
+                body=BODY,
+                headers={
+                    "ETag": ETAG,
+                    "Content-Range": f"bytes 0-{len(BODY) - 1}/{len(BODY)}",
+                },
+            )
+        return None
+
+    app = mk_app(drop=len(BODY) // 2, quirk=quirk)
+    manifest = {}
+
+    async def main():
+        async with serve(app) as (session, url):
+            with pytest.raises(aiohttp.ClientPayloadError):
+                await fetch(session, url, dst_file, manifest, retries=0)
+            # the part is resumed, answered wrong, then fetched whole
+            await fetch(session, url, dst_file, manifest, retries=5)
+
+    asyncio.run(main())
+    assert read(dst_file) == BODY
+    assert ranges(app)[1] == f"bytes={len(BODY) // 2}-"
+    assert ranges(app)[2] is None
+
+
+def test_unsatisfiable_range_starts_over(tmp_path):
+    dst_file = str(tmp_path / "f.json")
+    part_file = dst_file + ".part"
+    # left by a run against a longer body
+    with open(part_file, "wb") as f:
+        f.write(BODY + b"stale")
+    app = mk_app()
+
+    async def main():
+        async with serve(app) as (session, url):
+            manifest = {part_file: {"url": url, "validator": ETAG}}
+            await fetch(session, url, dst_file, manifest)
+            return manifest
+
+    manifest = asyncio.run(main())
+    assert read(dst_file) == BODY
+    assert ranges(app) == [f"bytes={len(BODY) + 5}-", None]
+    assert part_file not in manifest
+
+
+def test_changed_file_is_not_resumed(tmp_path):
+    dst_file = str(tmp_path / "f.json")
+    part_file = dst_file + ".part"
+    with open(part_file, "wb") as f:
+        f.write(b"from an older version")
+    app = mk_app(etag='"v2"')
+
+    async def main():
+        async with serve(app) as (session, url):
+            manifest = {part_file: {"url": url, "validator": ETAG}}
+            await fetch(session, url, dst_file, manifest)
+            return manifest
+
+    manifest = asyncio.run(main())
+    # If-Range did not match, so the server sent all of it
+    assert app[REQUESTS][0]["If-Range"] == ETAG
+    assert read(dst_file) == BODY
+    assert manifest[dst_file]["etag"] == '"v2"'
+
+
+def test_bodies_are_not_content_coded(tmp_path):
+    dst_file = str(tmp_path / "f.json")
+
+    def quirk(request):
+        response = web.Response(body=BODY, headers={"ETag": ETAG})
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            response.enable_compression()
+        return response
+
+    app = mk_app(quirk=quirk)
+
+    async def main():
+        async with serve(app) as (session, url):
+            return await fetch(session, url, dst_file, {})
+
+    transfer = asyncio.run(main())
+    assert app[REQUESTS][0]["Accept-Encoding"] == "identity"
+    assert transfer["bytes"] == len(BODY)
+    assert read(dst_file) == BODY
+
+
+def test_dropped_stream_resumes():
+    app = mk_app(drop=len(BODY) // 4 + 1)
+    pipe = download.Pipe(depth=len(BODY) // 4096 + 2)
+
+    async def main():
+        async with serve(app) as (session, url):
+            return await download.stream_file(
+                session, url, pipe, download.Scheduler(2), chunk_size=4096
+            )
+
+    transfer = asyncio.run(main())
+    assert transfer["ok"] and transfer["attempts"] == 4
+    assert pipe.read() == BODY
+
+
+def test_unchanged_file_is_not_refetched(tmp_path):
+    dst_file = str(tmp_path / "f.json")
+    app = mk_app()
+    manifest = {}
+
+    async def main():
+        async with serve(app) as (session, url):
+            await fetch(session, url, dst_file, manifest)
+            mtime = os.stat(dst_file).st_mtime_ns
+            transfer = await fetch(session, url, dst_file, manifest)
+            assert transfer["ok"] and transfer["bytes"] == 0
+            assert os.stat(dst_file).st_mtime_ns == mtime
+            # a file that no longer matches the manifest is fetched again
+            with open(dst_file, "ab") as f:
+                f.write(b"x")
+            await fetch(session, url, dst_file, manifest)
+
+    asyncio.run(main())
+    assert app[REQUESTS][1]["If-None-Match"] == ETAG
+    assert "If-None-Match" not in app[REQUESTS][2]
+    assert read(dst_file) == BODY
+    assert manifest[dst_file]["size"] == len(BODY)
+
+
+def test_no_plan_without_sizes(tmp_path, capsys):
+    app = mk_app()
+
+    async def main():
+        async with TestServer(app) as server:
+            url = str(server.make_url("/f"))
+            # a single file is never probed
+            await download.fetch_filepairs([(url, str(tmp_path / "one.json"))])
+            pairs = [(url, str(tmp_path / f"{i}.json")) for i in range(2)]
+            await download.fetch_filepairs(pairs, probe=False)
+
+    asyncio.run(main())
+    # three GETs and no HEAD
+    assert len(app[REQUESTS]) == 3
+    assert "makespan" not in capsys.readouterr().out
+
+
+def test_plan_uses_the_slots_reached(tmp_path, capsys):
+    app = mk_app()
+
+    async def main():
+        async with TestServer(app) as server:
+            url = str(server.make_url("/f"))
+            pairs = [(url, str(tmp_path / f"{i}.json")) for i in range(3)]
+            # sizes from an earlier fetch, of files since removed
+            manifest_path = str(tmp_path / "manifest.json")
+            jsonio.save(manifest_path, {dst: {"size": len(BODY)} for _, dst in pairs})
+            # the scheduler starts at 2 slots and has no time to ramp up
+            await download.fetch_filepairs(
+                pairs, max_concurrent=8, manifest_path=manifest_path
+            )
+
+    asyncio.run(main())
+    assert "on 2 slots from the start" in capsys.readouterr().out
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from newnoise import download
+from newnoise.aws import commands, data, db, split
+
+REGIONS = ["us-east-1", "eu-west-1", "cn-north-1"]
+FAMILIES = ["Compute Instance", "Storage", "Data Transfer"]
+
+
+def offer_file(path, n=60, prefix="S"):
+    """
+    Writes a small offer file. Every fifth product is a "Free" product in
+    us-east-1, whose OnDemand terms hold a free tier container applying to
+    products of the other families.
+    """
+    products, on_demand, reserved = {}, {}, {}
+    for i in range(n):
+        sku = "%s%04dX" % (prefix, i)
+        region = REGIONS[i % len(REGIONS)]
+        family = "Free" if i % 5 == 0 else FAMILIES[i % len(FAMILIES)]
+        products[sku] = {
+            "sku": sku,
+            "productFamily": family,
+            "attributes": {"servicecode": "AmazonEC2", "regionCode": region},
+        }
+        ccy = "CNY" if region.startswith("cn") else "USD"
+        term = sku + ".JRTCKXETXF"
+        dim = {
+            "rateCode": term + ".6YS6EN2CTY",
+            "description": "$%d per hour" % i,
+            "beginRange": "0",
+            "endRange": "Inf",
+            "unit": "Hrs",
+            "pricePerUnit": {ccy: "0.%04d" % i},
+            "appliesTo": [],
+        }
+        if family == "Free":
+            # free tiers for the next us-east-1 products
+            dim["endRange"] = "750"
+            dim["pricePerUnit"] = {"USD": "0"}
+            dim["appliesTo"] = [
+                "%s%04dX" % (prefix, j) for j in (i + 3, i + 6) if j < n
+            ]
+        on_demand[sku] = {
+            term: {
+                "offerTermCode": "JRTCKXETXF",
+                "sku": sku,
+                "effectiveDate": "2024-01-01T00:00:00Z",
+                "priceDimensions": {dim["rateCode"]: dim},
+                "termAttributes": {},
+            }
+        }
+        if i % 4 == 0:
+            rterm = sku + ".4NA7Y494T4"
+            reserved[sku] = {
+                rterm: {
+                    "offerTermCode": "4NA7Y494T4",
+                    "sku": sku,
+                    "effectiveDate": "2024-01-01T00:00:00Z",
+                    "priceDimensions": {
+                        rterm + ".2TG2D8R56U": {
+                            "rateCode": rterm + ".2TG2D8R56U",
+                            "description": "Upfront Fee",
+                            "unit": "Quantity",
+                            "pricePerUnit": {"USD": "100"},
+                            "appliesTo": [],
+                        }
+                    },
+                    "termAttributes": {
+                        "LeaseContractLength": "1yr",
+                        "OfferingClass": "standard",
+                        "PurchaseOption": "All Upfront",
+                    },
+                }
+            }
+    doc = {
+        "offerCode": "AmazonEC2",
+        "products": products,
+        "terms": {"OnDemand": on_demand, "Reserved": reserved},
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2)
+
+
+def dump(db_name):
+    dbconn = db.connect(db_name)
+    try:
+        return {row[1]: row for row in db.dump_products(dbconn)}
+    finally:
+        dbconn.close()
+
+
+def post_filter(rows, keep):
+    """
+    What a filtered load should leave of an unfiltered dump
+    """
+    kept = {}
+    for sku, row in rows.items():
+        product = {"productFamily": row[5], "attributes": json.loads(row[6])}
+        if not keep.wants_product(product):
+            continue
+        prices = json.loads(row[7])["aoc_for_prez_2028"]
+        prices = [
+            p
+            for p in prices
+            if keep.wants_terms(
+                "OnDemand" if p["purchaseOption"] == "on_demand" else "Reserved"
+            )
+            and any(c in p for c in keep.currencies)
+        ]
+        kept[sku] = row[:7] + (json.dumps({"aoc_for_prez_2028": prices}),)
+    return kept
+
+
+def load_sequential(db_name, filename, keep, compact=False):
+    dbconn = db.mk_db(db_name, compact_attributes=compact)
+    data.load_service(dbconn, filename, load_filter=keep)
+    dbconn.close()
+
+
+def load_whole_shard(db_name, filename, keep, tmp_path, compact=False):
+    dbconn = db.mk_db(db_name, compact_attributes=compact)
+    shard_name = str(tmp_path / "whole-shard.db")
+    result = data.load_shard(shard_name, filename, load_filter=keep)
+    commands.merge_parts(dbconn, filename, [(None, shard_name, None)], [result], keep)
+    dbconn.close()
+
+
+def load_split(db_name, filename, keep, tmp_path, compact=False):
+    dbconn = db.mk_db(db_name, compact_attributes=compact)
+    parts, results = [], []
+    for j, chunk in enumerate(split.offer_chunks(filename, chunk_size=2048)):
+        if chunk[0] != "products" and not keep.wants_terms(chunk[0]):
+            continue
+        shard_name = str(tmp_path / f"chunk-{j}.db")
+        results.append(data.load_chunk(shard_name, filename, *chunk, keep))
+        parts.append((chunk[0], shard_name, None))
+    assert len(parts) > 3
+    commands.merge_parts(dbconn, filename, parts, results, keep)
+    dbconn.close()
+
+
+def test_filtered_loads_match_filtered_dump(tmp_path):
+    filename = str(tmp_path / "AmazonEC2" / "resources.json")
+    offer_file(filename)
+    full_name = str(tmp_path / "full.db")
+    load_sequential(full_name, filename, None)
+
+    keep = data.LoadFilter(
+        terms=["OnDemand"],
+        currencies=["USD"],
+        regions=["us-east-1", "eu-west-1"],
+        families=["Compute Instance", "Storage"],
+    )
+    expected = post_filter(dump(full_name), keep)
+    # free tiers from products left out still move where prices start
+    assert any('"startUsageAmount": "750"' in row[7] for row in expected.values())
+
+    loads = {
+        "sequential": lambda name: load_sequential(name, filename, keep),
+        "whole": lambda name: load_whole_shard(name, filename, keep, tmp_path),
+        "split": lambda name: load_split(name, filename, keep, tmp_path),
+    }
+    for path, load in loads.items():
+        db_name = str(tmp_path / f"{path}.db")
+        load(db_name)
+        assert dump(db_name) == expected, path
+
+
+def piped(filename, cut=None):
+    """
+    A pipe holding `filename`, failing after `cut` bytes if given
+    """
+    with open(filename, "rb") as f:
+        body = f.read()
+    pipe = download.Pipe(depth=len(body) // 1024 + 2)
+    for pos in range(0, cut or len(body), 1024):
+        pipe.write(body[pos : min(pos + 1024, cut or len(body))])
+    pipe.finish(ConnectionResetError("dropped") if cut else None)
+    return pipe
+
+
+def test_failed_stream_leaves_no_rows(tmp_path):
+    filename = str(tmp_path / "AmazonEC2" / "resources.json")
+    offer_file(filename)
+    expected_name = str(tmp_path / "expected.db")
+    load_sequential(expected_name, filename, None)
+
+    db_name = str(tmp_path / "synced.db")
+    db.mk_db(db_name).close()
+    # parsers may wrap the error from the pipe
+    with pytest.raises(OSError):
+        data.load_pipe(
+            db_name, piped(filename, cut=os.path.getsize(filename) // 2), filename
+        )
+    assert dump(db_name) == {}
+
+    data.load_pipe(db_name, piped(filename), filename)
+    assert dump(db_name) == dump(expected_name)
+    assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".staging-")] == []
+
+
+def run_load(*argv):
+    parser = argparse.ArgumentParser()
+    commands.init_parsers(parser.add_subparsers())
+    args = parser.parse_args(["aws", "load", *argv])
+    args.func(args)
+
+
+def test_incremental_load_goes_past_broken_files(tmp_path):
+    root = tmp_path / "noises"
+    services = {"AmazonEC2": "E", "AmazonRDS": "R", "AmazonS3": "S"}
+    for service, prefix in services.items():
+        offer_file(str(root / service / "resources.json"), n=20, prefix=prefix)
+    with open(root / "root.json", "w") as f:
+        offers = {s: {"currentVersionUrl": f"/{s}.json"} for s in services}
+        json.dump({"offers": offers}, f)
+    db_name = str(tmp_path / "noises.db")
+    run_load("-d", str(root), "-n", db_name, "--incremental")
+    dbconn = db.connect(db_name)
+    before = db.sources(dbconn)
+    dbconn.close()
+
+    # RDS changes, and S3 breaks, ahead of it in file order
+    offer_file(str(root / "AmazonRDS" / "resources.json"), n=30, prefix="R")
+    s3_file = root / "AmazonS3" / "resources.json"
+    s3_file.write_bytes(s3_file.read_bytes()[: s3_file.stat().st_size // 2])
+    with open(root / "root.json", "w") as f:
+        offers = {s: {"currentVersionUrl": f"/{s}.json"} for s in reversed(services)}
+        json.dump({"offers": offers}, f)
+    with pytest.raises(SystemExit) as exit:
+        run_load("-d", str(root), "-n", db_name, "--incremental")
+    assert exit.value.code == 1
+
+    dbconn = db.connect(db_name)
+    after = db.sources(dbconn)
+    dbconn.close()
+    assert after["AmazonEC2"] == before["AmazonEC2"]
+    assert after["AmazonRDS"] != before["AmazonRDS"]
+    # S3 keeps its old rows and source, so the next run tries it again
+    assert after["AmazonS3"] == before["AmazonS3"]
+    rows = dump(db_name)
+    assert sum(sku.startswith("R") for sku in rows) == 30
+    assert sum(sku.startswith("S") for sku in rows) == 20
+    assert sum(sku.startswith("E") for sku in rows) == 20
+
+
+def test_compact_dumps_match_json_dumps(tmp_path):
+    root = tmp_path / "noises"
+    filename = str(root / "AmazonEC2" / "resources.json")
+    offer_file(filename)
+    with open(root / "root.json", "w") as f:
+        json.dump({"offers": {"AmazonEC2": {"currentVersionUrl": "/ec2.json"}}}, f)
+    everything = data.LoadFilter()
+    json_name = str(tmp_path / "json.db")
+    load_sequential(json_name, filename, everything)
+    expected = dump(json_name)
+
+    loads = {
+        "sequential": lambda name: load_sequential(name, filename, everything, True),
+        "whole": lambda name: load_whole_shard(
+            name, filename, everything, tmp_path, True
+        ),
+        "split": lambda name: load_split(name, filename, everything, tmp_path, True),
+        "incremental": lambda name: run_load(
+            "-d", str(root), "-n", name, "--incremental", "--compact-attributes"
+        ),
+    }
+    for path, load in loads.items():
+        db_name = str(tmp_path / f"{path}.db")
+        load(db_name)
+        dbconn = db.connect(db_name)
+        assert db.attributes_encoding(dbconn) == db.COMPACT_ATTRIBUTES, path
+        dbconn.close()
+        assert dump(db_name) == expected, path
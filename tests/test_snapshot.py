@@ -0,0 +1,112 @@
+import os
+
+from newnoise import snapshot
+
+
+def write(path, data):
+    """
+    Replaces the file at `path` like a fetch does, with a new inode
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.part", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.part", path)
+
+
+def blobs(root):
+    found = set()
+    for dirpath, _, filenames in os.walk(snapshot.blobs_dir(root)):
+        found.update(os.path.join(dirpath, name) for name in filenames)
+    return found
+
+
+def fetched(root):
+    paths = {
+        "ec2": os.path.join(root, "AmazonEC2", "resources.json"),
+        "s3": os.path.join(root, "AmazonS3", "resources.json.zst"),
+        "root": os.path.join(root, "root.json"),
+    }
+    write(paths["ec2"], b'{"offerCode": "AmazonEC2"}')
+    write(paths["s3"], b"compressed S3")
+    write(paths["root"], b'{"offers": {}}')
+    return paths
+
+
+def test_days_share_blobs_of_unchanged_files(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    paths = fetched(root)
+    first = snapshot.take(root, paths.values(), date="2024-05-01")
+    assert len(blobs(root)) == 3
+    assert first["files"]["AmazonS3/resources.json.zst"]["blob"].endswith(".json.zst")
+
+    hashed = []
+    digest = snapshot.file_digest
+    monkeypatch.setattr(
+        snapshot, "file_digest", lambda path: hashed.append(path) or digest(path)
+    )
+    # the fetch replaced S3, the others are still the blobs they were
+    write(paths["s3"], b"compressed S3, changed")
+    second = snapshot.take(root, paths.values(), date="2024-05-02")
+    assert hashed == [paths["s3"]]
+    assert len(blobs(root)) == 4
+    assert second["files"]["root.json"] == first["files"]["root.json"]
+
+    # a refetch with the same bytes is hashed again, but shares the blob
+    write(paths["ec2"], b'{"offerCode": "AmazonEC2"}')
+    third = snapshot.take(root, paths.values(), date="2024-05-03")
+    assert hashed[1:] == [paths["ec2"]]
+    assert len(blobs(root)) == 4
+    ec2 = "AmazonEC2/resources.json"
+    assert third["files"][ec2]["blob"] == first["files"][ec2]["blob"]
+    assert snapshot.dates(root) == ["2024-05-01", "2024-05-02", "2024-05-03"]
+
+
+def test_checkout_lays_out_a_day(tmp_path):
+    root = str(tmp_path)
+    paths = fetched(root)
+    snapshot.take(root, paths.values(), date="2024-05-01")
+    write(paths["ec2"], b"a later EC2")
+    snapshot.take(root, paths.values(), date="2024-05-02")
+
+    checkout = snapshot.checkout(root, "2024-05-01")
+    with checkout as checkout_root:
+        assert os.path.dirname(checkout_root) == root
+        assert os.path.basename(checkout_root).startswith(".snapshot-2024-05-01-")
+        found = {}
+        for dirpath, _, filenames in os.walk(checkout_root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                with open(path, "rb") as f:
+                    found[os.path.relpath(path, checkout_root)] = f.read()
+        assert found == {
+            "AmazonEC2/resources.json": b'{"offerCode": "AmazonEC2"}',
+            "AmazonS3/resources.json.zst": b"compressed S3",
+            "root.json": b'{"offers": {}}',
+        }
+    assert not os.path.exists(checkout_root)
+
+
+def test_prune_keeps_blobs_still_referred_to(tmp_path):
+    root = str(tmp_path)
+    paths = fetched(root)
+    first = snapshot.take(root, paths.values(), date="2024-05-01")
+    write(paths["ec2"], b"a later EC2")
+    snapshot.take(root, paths.values(), date="2024-05-02")
+    write(paths["ec2"], b"the latest EC2")
+    latest = snapshot.take(root, paths.values(), date="2024-05-03")
+    assert len(blobs(root)) == 5
+
+    dropped, freed = snapshot.prune(root, 2)
+    assert dropped == ["2024-05-01"]
+    old_ec2 = first["files"]["AmazonEC2/resources.json"]
+    assert freed == old_ec2["size"]
+    assert not os.path.exists(snapshot.blob_path(root, old_ec2["blob"]))
+    assert len(blobs(root)) == 4
+
+    assert snapshot.prune(root, 1) == (["2024-05-02"], len(b"a later EC2"))
+    assert blobs(root) == {
+        snapshot.blob_path(root, entry["blob"]) for entry in latest["files"].values()
+    }
+    # the files fetched are left alone
+    assert all(os.path.exists(path) for path in paths.values())
+    assert snapshot.prune(root, 1) == ([], 0)
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from newnoise.aws import split
+
+
+def offer_doc(n=40):
+    """
+    An offer document whose strings look like the keys and entries the
+    splitter searches for.
+    """
+    products, on_demand, reserved = {}, {}, {}
+    for i in range(n):
+        sku = "S%04dX" % i
+        products[sku] = {
+            "sku": sku,
+            "productFamily": "Compute Instance",
+            "attributes": {
+                "servicecode": "AmazonEC2",
+                # quotes and braces inside strings
+                "note": '"products": {"%s": {"sku": "%s"' % (sku, sku),
+                "usagetype": '"terms": {"OnDemand": {',
+            },
+        }
+        term = {
+            sku + ".JRTCKXETXF": {
+                "offerTermCode": "JRTCKXETXF",
+                "sku": sku,
+                "priceDimensions": {
+                    sku + ".JRTCKXETXF.6YS6EN2CTY": {
+                        "description": '"%s": {"%s.' % (sku, sku),
+                        "pricePerUnit": {"USD": "0.%04d" % i},
+                    }
+                },
+            }
+        }
+        on_demand[sku] = term
+        if i % 3 == 0:
+            reserved[sku] = term
+    return {
+        "formatVersion": "v1.0",
+        "offerCode": "AmazonEC2",
+        "products": products,
+        "terms": {"OnDemand": on_demand, "Reserved": reserved},
+    }
+
+
+@pytest.mark.parametrize("indent", [None, 2, "\t"])
+@pytest.mark.parametrize("chunk_size", [1, 700, 10**9])
+def test_chunks_cover_every_entry_once(tmp_path, indent, chunk_size):
+    doc = offer_doc()
+    filename = str(tmp_path / "resources.json")
+    with open(filename, "w") as f:
+        json.dump(doc, f, indent=indent)
+
+    chunks = split.offer_chunks(filename, chunk_size=chunk_size)
+    assert [c[0] for c in chunks] == sorted(
+        (c[0] for c in chunks), key=["products", "OnDemand", "Reserved"].index
+    )
+    found = {"products": {}, "OnDemand": {}, "Reserved": {}}
+    for section, start, end in chunks:
+        entries = split.entries(split.read_chunk(filename, start, end))
+        if chunk_size == 1:
+            # every entry starts a chunk of its own, but the first chunk
+            # of a section may hold just the whitespace before its first entry
+            assert len(entries) <= 1
+        assert not set(entries) & set(found[section])
+        found[section].update(entries)
+
+    assert found["products"] == doc["products"]
+    assert found["OnDemand"] == doc["terms"]["OnDemand"]
+    assert found["Reserved"] == doc["terms"]["Reserved"]
+
+
+def test_entries_stop_at_the_end_of_the_section():
+    text = ' "a": {"x": [1, {"}": "]"}]},\n  "b": "c\\"d"\n },\n "next": {"e": 1}}'
+    assert split.entries(text) == {"a": {"x": [1, {"}": "]"}]}, "b": 'c"d'}
+    assert split.entries("\n  }") == {}